@@ -0,0 +1,112 @@
+import csv
+import io
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from engine import ClassificationEngine
+
+
+TRUE_VALUES = {"1", "true", "yes", "y", "t"}
+
+# Each worker process compiles the rule graph once, in the pool initializer
+_engine = None
+
+
+def load_engine(knowledge_base_path) -> ClassificationEngine:
+    with open(knowledge_base_path, 'r') as file:
+        knowledge_data = json.load(file)
+    return ClassificationEngine.from_knowledge_data(knowledge_data)
+
+
+def _init_worker(knowledge_base_path) -> None:
+    global _engine
+    _engine = load_engine(knowledge_base_path)
+
+
+def parse_value(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in TRUE_VALUES
+    return bool(value)
+
+
+def parse_lines(lines, input_format, header):
+    # Values stay raw here; only the handful of features a record's path touches get parsed
+    if input_format == "csv":
+        for row in csv.reader(lines):
+            if row:
+                yield dict(zip(header, row))
+    else:
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+
+def format_results(results, output_format) -> str:
+    if output_format == "csv":
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows((group, " > ".join(path)) for group, path in results)
+        return buffer.getvalue()
+    return "".join(json.dumps({"group": group, "path": list(path)}) + "\n" for group, path in results)
+
+
+def classify_chunk(lines, input_format, header, output_format) -> tuple:
+    records = parse_lines(lines, input_format, header)
+    results = [_engine.classify(lambda name: parse_value(record.get(name, False))) for record in records]
+    return len(results), format_results(results, output_format)
+
+
+def detect_format(path, default) -> str:
+    if path in (None, "-"):
+        return default
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def run_batch(input_path, output_path, knowledge_base_path='knowledge_base.json',
+              workers=None, chunk_size=10000, input_format=None, output_format=None) -> int:
+    # Streams the input in chunks through a process pool and writes results in input order
+    input_format = input_format or detect_format(input_path, "jsonl")
+    output_format = output_format or detect_format(output_path, "jsonl")
+    workers = workers or os.cpu_count() or 1
+
+    source = sys.stdin if input_path in (None, "-") else open(input_path, 'r', newline='')
+    target = sys.stdout if output_path in (None, "-") else open(output_path, 'w', newline='')
+    start_time = time.perf_counter()
+    row_count = 0
+
+    try:
+        header = None
+        if input_format == "csv":
+            header = next(csv.reader([source.readline()]), [])
+        if output_format == "csv":
+            target.write("group,path\n")
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(knowledge_base_path,)) as executor:
+            # Keep a bounded number of chunks in flight so memory stays flat on huge inputs
+            pending = deque()
+            while True:
+                lines = list(islice(source, chunk_size))
+                if lines:
+                    pending.append(executor.submit(classify_chunk, lines, input_format, header, output_format))
+                if pending and (len(pending) >= workers * 2 or not lines):
+                    chunk_rows, text = pending.popleft().result()
+                    target.write(text)
+                    row_count += chunk_rows
+                if not lines and not pending:
+                    break
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+
+    elapsed = time.perf_counter() - start_time
+    rate = row_count / elapsed if elapsed > 0 else 0.0
+    print(f"Classified {row_count} rows in {elapsed:.2f} s ({rate:,.0f} rows/sec) with {workers} workers",
+          file=sys.stderr)
+    return row_count
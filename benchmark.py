@@ -0,0 +1,514 @@
+import argparse
+import copy
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import types
+import zlib
+
+import classification_program
+import dictionary_view
+from engine import ClassificationEngine
+from image_cache import image_cache, load_image
+from kb_compiler import CompiledKnowledgeBase, validate_knowledge_data, validate_knowledge_update, write_compiled
+from knowledge_file import KnowledgeFile, LazySection
+from rule_graph import compile_rule_graph, update_rule_graph
+from session_log import SessionLogger
+from thumbnails import ANIMAL_IMAGE_SIZE
+import tree_viewer
+
+
+KNOWLEDGE_BASE_PATH = "knowledge_base.json"
+BASELINE_PATH = "benchmark_baseline.json"
+SCALES = (1, 10, 100, 1000)
+
+
+class StubWidget:
+    # Stand-in for every Tk widget and for the root window, so the GUI code paths can be timed
+    # without a display. after/after_idle callbacks are queued and run by drain().
+    def __init__(self, master=None, *args, **options) -> None:
+        self.master = master
+        self.options = dict(options)
+        self.scheduled = master.scheduled if isinstance(master, StubWidget) else []
+
+    def __getattr__(self, name):
+        if name.startswith("winfo_"):
+            return lambda *args: 1000
+        return lambda *args, **kwargs: None
+
+    def __getitem__(self, key):
+        return self.options.get(key)
+
+    def __setitem__(self, key, value) -> None:
+        self.options[key] = value
+
+    def config(self, **options) -> None:
+        self.options.update(options)
+
+    configure = config
+
+    def after(self, delay, callback=None, *args):
+        self.scheduled.append((callback, args))
+        return len(self.scheduled)
+
+    def after_idle(self, callback, *args):
+        return self.after(0, callback, *args)
+
+    def drain(self, wait=0.001, timeout=10.0) -> None:
+        deadline = time.perf_counter() + timeout
+        while self.scheduled and time.perf_counter() < deadline:
+            callback, args = self.scheduled.pop(0)
+            callback(*args)
+            if wait:
+                time.sleep(wait)
+
+
+class StubStringVar:
+    def __init__(self, master=None, value="") -> None:
+        self.value = value
+        self.traces = []
+
+    def get(self):
+        return self.value
+
+    def set(self, value) -> None:
+        self.value = value
+        for callback in self.traces:
+            callback()
+
+    def trace_add(self, mode, callback) -> None:
+        self.traces.append(callback)
+
+
+class StubPhotoImage:
+    # Copies the pixels like ImageTk.PhotoImage does, without a Tk interpreter
+    def __init__(self, image=None, master=None, **options) -> None:
+        self.data = image.tobytes() if image is not None else b""
+
+
+class StubFont:
+    # Rough Arial metrics, enough for the dictionary's row layout
+    def __init__(self, root=None, size=12, **options) -> None:
+        self.size = size
+
+    def measure(self, text) -> int:
+        return len(text) * self.size * 6 // 10
+
+    def metrics(self, name) -> int:
+        return self.size * 3 // 2
+
+
+def install_stub_tk() -> StubWidget:
+    stub_tk = types.SimpleNamespace(
+        Tk=StubWidget, Frame=StubWidget, Label=StubWidget, Button=StubWidget, Toplevel=StubWidget,
+        Canvas=StubWidget, Scrollbar=StubWidget, Entry=StubWidget, StringVar=StubStringVar,
+        PhotoImage=StubPhotoImage, font=types.SimpleNamespace(Font=StubFont),
+    )
+    classification_program.tk = stub_tk
+    classification_program.Label = StubWidget
+    dictionary_view.tk = stub_tk
+    tree_viewer.tk = stub_tk
+
+    from PIL import ImageTk
+
+    ImageTk.PhotoImage = StubPhotoImage
+    return StubWidget()
+
+
+def measure(function, iterations, warmup) -> list:
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples, unit="ms") -> dict:
+    ordered = sorted(samples)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+    return {
+        "unit": unit,
+        "n": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "min": ordered[0],
+        "p50": percentile(0.50),
+        "p90": percentile(0.90),
+        "p99": percentile(0.99),
+    }
+
+
+def synthetic_knowledge_data(scale, seed=0) -> dict:
+    # A full binary rule tree of about 57 * scale rules with three unique features per rule
+    rule_count = 57 * scale
+    internal_count = rule_count // 2
+    total = 2 * internal_count + 1
+    rng = random.Random(seed)
+
+    def group(index):
+        return f"group {index}" if index < internal_count else f"classification group {index}"
+
+    knowledge_base, rules = [], []
+    for index in range(total):
+        if index < internal_count:
+            features = [f"feature {index}.{position}" for position in range(3)]
+            knowledge_base.append({
+                "animal group": group(index),
+                "features": [{"name": name, "question": f"Does the animal have {name}?"} for name in features],
+            })
+            rules.append({
+                "current animal group": group(index),
+                "required features": features,
+                "new direction": group(2 * index + 1),
+                "else": group(2 * index + 2),
+            })
+        else:
+            rules.append({
+                "current animal group": group(index),
+                "end classification": f"The animal is classified as {group(index)}.\n Synthetic → {rng.randint(0, 9)}",
+            })
+    return {"Knowledge base": knowledge_base, "Rules": rules, "Dictionary": [], "Animal media": []}
+
+
+class RandomAnswers:
+    # Deterministic pseudo-random answers for any feature, without materialising a dict
+    def __init__(self, seed) -> None:
+        self.seed = seed
+
+    def get(self, name, default=None) -> bool:
+        return bool(zlib.crc32(f"{self.seed}:{name}".encode("utf-8")) & 1)
+
+
+def make_app(root, log_dir, knowledge_path=KNOWLEDGE_BASE_PATH):
+    knowledge_file = KnowledgeFile(knowledge_path)
+    return classification_program.KnowledgeBaseApp(
+        root,
+        knowledge_file.section("Knowledge base"),
+        knowledge_file.section("Rules"),
+        LazySection(knowledge_file, "Dictionary"),
+        LazySection(knowledge_file, "Animal media", {}),
+        LazySection(knowledge_file, "Instructions", ""),
+        session_logger=SessionLogger(log_dir),
+    )
+
+
+def bench_load(results, iterations, warmup, work_dir) -> None:
+    with open(KNOWLEDGE_BASE_PATH, "r") as file:
+        knowledge_data = json.load(file)
+
+    def full_json():
+        with open(KNOWLEDGE_BASE_PATH, "r") as file:
+            data = json.load(file)
+        compile_rule_graph(data["Knowledge base"], data["Rules"])
+
+    def lazy_json():
+        knowledge_file = KnowledgeFile(KNOWLEDGE_BASE_PATH)
+        compile_rule_graph(knowledge_file.section("Knowledge base"), knowledge_file.section("Rules"))
+
+    compiled_path = os.path.join(work_dir, "knowledge_base.kbc")
+    write_compiled(knowledge_data, compiled_path)
+
+    results["load.full_json"] = summarize(measure(full_json, iterations, warmup))
+    results["load.lazy_json"] = summarize(measure(lazy_json, iterations, warmup))
+    results["load.compiled"] = summarize(measure(lambda: CompiledKnowledgeBase(compiled_path), iterations, warmup))
+
+
+def drain_tk(root, image_loader, wait=0.0005, timeout=10.0) -> None:
+    # Runs the real Tk event loop until every background image load has been handed over
+    deadline = time.perf_counter() + timeout
+    root.update()
+    while image_loader.busy and time.perf_counter() < deadline:
+        time.sleep(wait)
+        root.update()
+
+
+def bench_gui(results, iterations, warmup, root, work_dir) -> None:
+    app = make_app(root, os.path.join(work_dir, "session_logs"))
+    if isinstance(root, StubWidget):
+        drain = root.drain
+    else:
+        drain = lambda wait=0.0005: drain_tk(root, app.image_loader, wait)
+    rng = random.Random(1)
+    answer_samples = []
+    end_samples = []
+    ready_samples = []
+
+    def one_session():
+        app.restart_program()
+        app.start()
+        while not app.session.finished:
+            user_input = rng.choice(("Yes", "No"))
+            # end_classification runs inside the answer that finishes the session
+            finishing = _finishes(app.session, user_input == "Yes")
+            start = time.perf_counter()
+            app.answer(user_input)
+            elapsed = (time.perf_counter() - start) * 1000
+            (end_samples if finishing else answer_samples).append(elapsed)
+        start = time.perf_counter()
+        drain(wait=0.0005)
+        ready_samples.append((time.perf_counter() - start) * 1000)
+
+    for _ in range(warmup):
+        one_session()
+    answer_samples.clear()
+    end_samples.clear()
+    ready_samples.clear()
+    for _ in range(iterations):
+        one_session()
+
+    results["gui.answer"] = summarize(answer_samples)
+    results["gui.end_classification"] = summarize(end_samples)
+    results["gui.result_images_ready"] = summarize(ready_samples)
+
+    def cold_images():
+        image_cache.clear()
+        for group in app.animal_media:
+            for media in group.values():
+                for animal in media["Images"]:
+                    load_image(animal["File"], ANIMAL_IMAGE_SIZE)
+
+    results["images.decode_all_thumbnails"] = summarize(measure(cold_images, max(1, iterations // 10), 1))
+
+    def build_tree_pyramid():
+        tile_dir = os.path.join(work_dir, "tiles")
+        shutil.rmtree(tile_dir, ignore_errors=True)
+        tree_viewer.build_pyramid(classification_program.TREE_IMAGE_PATH, tile_dir)
+
+    results["tree.build_pyramid"] = summarize(measure(build_tree_pyramid, max(1, iterations // 25), 0))
+
+    def first_tree_open():
+        # A new window over the pyramid prepared at startup, including its first visible tiles
+        if app.tree_viewer is not None:
+            app.tree_viewer.window.destroy()
+        app.tree_viewer = None
+        app.show_classification_tree()
+
+    app.prepare_tree_pyramid()
+    drain(wait=0.0005)
+    results["gui.show_classification_tree.first"] = summarize(measure(first_tree_open, iterations, warmup))
+    results["gui.show_classification_tree.reopen"] = summarize(measure(app.show_classification_tree, iterations, warmup))
+
+    def first_dictionary_open():
+        app.dictionary_window = None
+        app.open_dictionary()
+
+    results["gui.open_dictionary.first"] = summarize(measure(first_dictionary_open, iterations, warmup))
+    results["gui.open_dictionary.reopen"] = summarize(measure(app.open_dictionary, iterations, warmup))
+    app.session_logger.close()
+
+
+def _finishes(session, value) -> bool:
+    # Whether answering value ends the session, without changing the session
+    if session.feature_index == 0:
+        return False
+    asked = [session.graph.features[session.node.feature_ids[position]] for position in session.asked_positions()]
+    answers = [session.answers.get(name, False) for name in asked[:session.feature_index]] + [value]
+    if len(answers) == 2 and answers[0] != answers[1]:
+        return False
+    decision = answers[0] if answers[0] == answers[1] else answers[2]
+    child = session.node.yes if decision else session.node.no
+    return session.graph.nodes[child].is_terminal
+
+
+def bench_batch(results, iterations, warmup, scales, records, work_dir) -> None:
+    for scale in scales:
+        knowledge_data = synthetic_knowledge_data(scale)
+        results[f"batch.x{scale}.compile"] = summarize(
+            measure(lambda: ClassificationEngine.from_knowledge_data(knowledge_data), 3, 1))
+        # Opening a compiled knowledge base reads only its header, so this should not grow with the scale
+        compiled_path = os.path.join(work_dir, f"synthetic-x{scale}.kbc")
+        write_compiled(knowledge_data, compiled_path)
+        results[f"batch.x{scale}.load_compiled"] = summarize(
+            measure(lambda: CompiledKnowledgeBase(compiled_path), iterations, warmup))
+        engine = ClassificationEngine.from_knowledge_data(knowledge_data)
+
+        answer_sets = [RandomAnswers(seed) for seed in range(records)]
+        samples = measure(lambda: engine.classify_batch(answer_sets), iterations, warmup)
+        results[f"batch.x{scale}.per_record"] = summarize([sample * 1000 / records for sample in samples], unit="us")
+
+        try:
+            import numpy as np
+        except ImportError:
+            continue
+        rows = max(100, min(100000, 50_000_000 // max(1, len(engine.graph.features))))
+        matrix = np.random.default_rng(scale).random((rows, len(engine.graph.features))) < 0.5
+        samples = measure(lambda: engine.classify_matrix(matrix), max(1, iterations // 5), 1)
+        results[f"batch.x{scale}.vectorized_per_row"] = summarize([sample * 1000 / rows for sample in samples], unit="us")
+
+
+def random_edit(knowledge_data, rng, name) -> dict:
+    # A copy of knowledge_data with one or two random edits of the kind made by hand: retargeted
+    # edges, moved, deleted, renamed or added rules, changed features, questions and images.
+    # Many of them make the knowledge base invalid (cycles, dangling targets, missing questions).
+    data = copy.deepcopy(knowledge_data)
+    rules = data["Rules"]
+    groups = [rule["current animal group"] for rule in rules]
+    features = [feature["name"] for group in data["Knowledge base"] for feature in group["features"]]
+    for _ in range(rng.randint(1, 2)):
+        kind = rng.randrange(10)
+        position = rng.randrange(len(rules))
+        rule = rules[position]
+        branching = bool(rule.get("required features"))
+        if kind == 0 and branching:
+            rule["else"] = rng.choice(groups)
+        elif kind == 1 and branching:
+            rule["new direction"] = rng.choice(groups)
+        elif kind == 2:
+            rules.insert(rng.randrange(len(rules)), rules.pop(position))
+        elif kind == 3:
+            rules.insert(0, rules.pop(position))
+        elif kind == 4 and len(rules) > 1:
+            del rules[position]
+        elif kind == 5 and branching:
+            rule["required features"][rng.randrange(len(rule["required features"]))] = rng.choice(features + [name])
+        elif kind == 6 and data["Knowledge base"]:
+            feature = rng.choice(rng.choice(data["Knowledge base"])["features"])
+            feature["question"] = feature.get("question", "") + " (edited)"
+        elif kind == 7 and not branching:
+            added = dict(copy.deepcopy(rule), **{"current animal group": name})
+            rules.append(added)
+            parent = rng.choice([rule for rule in rules if rule.get("required features")] or [None])
+            if parent is not None:
+                parent[rng.choice(("new direction", "else"))] = name
+        elif kind == 8:
+            rule["current animal group"] = name
+        elif kind == 9 and data.get("Animal media"):
+            media = rng.choice(list(rng.choice(data["Animal media"]).values()))
+            if media.get("Images"):
+                image = rng.choice(media["Images"])
+                image["File"] = image["File"] + ".missing" if rng.random() < 0.5 else image["File"].removesuffix(".missing")
+    return data
+
+
+def check_incremental(knowledge_data, trials, seed=0, base_dir=".", answer_sets=200) -> list:
+    # Chains random edits and checks the incremental hot reload path against the full one:
+    # validate_knowledge_update must accept and reject exactly what validate_knowledge_data does,
+    # and update_rule_graph must give a graph that classifies like a fresh compile_rule_graph.
+    # Returns a description of every mismatch.
+    rng = random.Random(seed)
+    mismatches = []
+    previous_data = knowledge_data
+    previous_graph = compile_rule_graph(knowledge_data["Knowledge base"], knowledge_data["Rules"])
+    accepted = 0
+    for trial in range(trials):
+        data = random_edit(previous_data, rng, f"edited group {trial}")
+        full_valid = not validate_knowledge_data(data, base_dir)
+        update_valid = not validate_knowledge_update(data, previous_data, base_dir)
+        if full_valid != update_valid:
+            mismatches.append(f"edit {trial}: validate_knowledge_data says {'valid' if full_valid else 'invalid'}, "
+                              f"validate_knowledge_update says {'valid' if update_valid else 'invalid'}")
+        if not full_valid or not update_valid:
+            continue
+
+        accepted += 1
+        graph, _ = update_rule_graph(previous_graph, data["Knowledge base"], data["Rules"], previous_data["Rules"],
+                                     data["Knowledge base"] != previous_data["Knowledge base"])
+        fresh = compile_rule_graph(data["Knowledge base"], data["Rules"])
+        if set(graph.index) != set(fresh.index):
+            mismatches.append(f"edit {trial}: groups differ: {sorted(set(graph.index) ^ set(fresh.index))}")
+        for group in fresh.index:
+            node, fresh_node = graph.node_for(group), fresh.node_for(group)
+            if node is None or (node.questions, node.message) != (fresh_node.questions, fresh_node.message) or \
+                    graph.feature_names(graph.index[group]) != fresh.feature_names(fresh.index[group]):
+                mismatches.append(f"edit {trial}: rule '{group}' differs from a fresh compile")
+        engine, fresh_engine = ClassificationEngine(graph), ClassificationEngine(fresh)
+        for answers in (RandomAnswers(seed * answer_sets + index) for index in range(answer_sets)):
+            if engine.classify(answers.get) != fresh_engine.classify(answers.get):
+                mismatches.append(f"edit {trial}: classifies differently from a fresh compile")
+                break
+        previous_data, previous_graph = data, graph
+
+    print(f"Incremental check: {trials} random edits, {accepted} accepted and applied in a chain, "
+          f"{len(mismatches)} mismatch(es)")
+    return mismatches
+
+
+def compare(results, baseline, threshold) -> list:
+    regressions = []
+    for name, summary in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None or not previous["p50"]:
+            print(f"{name:42s} p50 {summary['p50']:10.3f} {summary['unit']:2s}  (new)")
+            continue
+        ratio = summary["p50"] / previous["p50"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        print(f"{name:42s} p50 {summary['p50']:10.3f} {summary['unit']:2s}  baseline {previous['p50']:10.3f}  x{ratio:5.2f}{flag}")
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def print_results(results) -> None:
+    for name, summary in sorted(results.items()):
+        print(f"{name:42s} n={summary['n']:<5d} mean {summary['mean']:10.3f}  p50 {summary['p50']:10.3f}  "
+              f"p90 {summary['p90']:10.3f}  p99 {summary['p99']:10.3f} {summary['unit']}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmarks for the classification pipeline")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--scales", type=int, nargs="*", default=list(SCALES), help="Synthetic knowledge base sizes (x 57 rules)")
+    parser.add_argument("--records", type=int, default=2000, help="Answer sets per batch benchmark")
+    parser.add_argument("--real-tk", action="store_true", help="Use the real Tk (needs a display, e.g. xvfb-run)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--threshold", type=float, default=1.25, help="p50 ratio over the baseline that counts as a regression")
+    parser.add_argument("--check-incremental", type=int, metavar="EDITS",
+                        help="Instead of timing, check hot reload's incremental validation and recompilation "
+                             "against the full ones over this many random edits")
+    args = parser.parse_args(argv)
+
+    if args.check_incremental is not None:
+        with open(KNOWLEDGE_BASE_PATH, "r") as file:
+            knowledge_data = json.load(file)
+        mismatches = check_incremental(knowledge_data, args.check_incremental,
+                                       base_dir=os.path.dirname(KNOWLEDGE_BASE_PATH) or ".")
+        mismatches += check_incremental(synthetic_knowledge_data(10), args.check_incremental, seed=1)
+        for mismatch in mismatches:
+            print(f"Error: {mismatch}", file=sys.stderr)
+        return 1 if mismatches else 0
+
+    if args.real_tk:
+        import tkinter
+
+        root = tkinter.Tk()
+    else:
+        root = install_stub_tk()
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="benchmark-") as work_dir:
+        bench_load(results, args.iterations, args.warmup, work_dir)
+        bench_gui(results, args.iterations, args.warmup, root, work_dir)
+        bench_batch(results, max(1, args.iterations // 10), 1, args.scales, args.records, work_dir)
+    print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r") as file:
+            baseline = json.load(file)
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) regressed by more than x{args.threshold}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,29 +1,97 @@
 import tkinter as tk
-from tkinter import Label, Toplevel
+from tkinter import Label
+import argparse
 import json
-
-from PIL import Image, ImageTk
+import sys
+import time
+
+from dictionary_view import DictionaryIndex, DictionaryWindow
+from engine import ClassificationEngine
+from image_cache import image_cache
+from hot_reload import HotReloader, node_map
+from image_loader import AsyncImageLoader
+from instrumentation import Metrics, instrument_app, start_metrics, write_snapshot
+from kb_compiler import compiled_path, load_compiled_if_fresh, validate_knowledge_data, write_compiled
+from knowledge_file import KnowledgeFile, LazySection
+from prefetch import Prefetcher, branch_statistics
+from rule_graph import compile_rule_graph
+from question_order import AnswerStatistics, question_report
+from session_log import SESSION_LOG_DIR, SessionLogger, read_sessions
+from thumbnails import ANIMAL_IMAGE_SIZE, TREE_IMAGE_PATH, remove_thumbnails
+from tree_viewer import TilePyramid, TreeViewer, build_pyramid, remove_pyramid
 
 
 class KnowledgeBaseApp:
-    def __init__(self, root, knowledge_base, rules, dictionary, animal_media, instructions) -> None:
+    # Result screen of a session with "Don't know" answers
+    CANDIDATES_SHOWN = 5
+    CANDIDATES_WITH_IMAGES = 3
+
+    def __init__(self, root, knowledge_base, rules, dictionary, animal_media, instructions, graph=None,
+                 session_logger=None, feature_order=None, metrics=None) -> None:
         self.root = root
         self.knowledge_base = knowledge_base
         self.rules = rules
         self.dictionary = dictionary
         self.animal_media = animal_media
         self.instructions = instructions
-        self.current_rule_index = None
-        self.current_feature_index = 0
-        self.answers = {}
-        self.current_question = None
+        self.graph = graph if graph is not None else compile_rule_graph(knowledge_base, rules)
+        self.engine = ClassificationEngine(self.graph, feature_order, branch_statistics)
+        self.session = self.engine.new_session()
+        self.image_loader = AsyncImageLoader(root, image_cache)
+        self.prefetcher = Prefetcher(self.graph, self.image_loader, self.media_for_group, ANIMAL_IMAGE_SIZE)
+        self._media_index = None
+        self._media_loading = False
+        self.result_widgets = []
+        self.dictionary_window = None
+        self.tree_viewer = None
+        # The classification tree's tile pyramid, built on a loader worker (see prepare_tree_pyramid)
+        self.tree_pyramid = None
+        self._tree_build = None
+        self._show_tree_when_built = False
+        self.session_logger = session_logger if session_logger is not None else SessionLogger()
+        self.session_logged = True
+        if metrics is not None:
+            # Wrapped before setup_gui so the buttons' commands are the timed versions
+            instrument_app(self, metrics)
         self.setup_gui()
+        self.root.protocol("WM_DELETE_WINDOW", self.close_program)
 
     def restart_program(self):
-        # Restarts the entire program
-        self.root.quit()
+        # Starts a new session in place, reusing the loaded data, caches and widget tree
+        self.log_session()
+        self.image_loader.cancel_all()
+        for widget in self.result_widgets:
+            widget.destroy()
+        self.result_widgets = []
+        self.session = self.engine.new_session()
+
+        self.animal_group_label.place_forget()
+        self.question_label.place_forget()
+        self.yes_button.pack_forget()
+        self.dont_know_button.pack_forget()
+        self.no_button.pack_forget()
+        self.answer_button_frame.place_forget()
+        self.show_welcome_screen()
+
+    def close_program(self) -> None:
+        self.log_session()
+        self.session_logger.close()
+        self.image_loader.shutdown()
         self.root.destroy()
-        main()
+
+    def log_session(self) -> None:
+        # Every started session is logged once, whether it was completed or abandoned
+        if not self.session_logged:
+            record = self.session.record()
+            record["completed"] = self.session.finished
+            record["question_order"] = "adaptive" if self.engine.feature_order else "file"
+            self.session_logger.log(record)
+            self.session_logged = True
+
+    def show_welcome_screen(self) -> None:
+        self.welcome_label.place(relx=0.5, rely=0.4, anchor="center")
+        self.instructions_label.place(relx=0.5, rely=0.465, anchor="center")
+        self.start_button.place(relx=0.5, rely=0.6, anchor="center")
 
     def exit_fullscreen(self, event=None) -> None:
         # Exit the full-screen mode when the ESC key is pressed
@@ -71,7 +139,6 @@ class KnowledgeBaseApp:
             font=("Arial", 40, "bold"),
             wraplength=1200
         )
-        self.welcome_label.place(relx=0.5, rely=0.4, anchor="center")
 
         self.instructions_label = tk.Label(
             self.main_frame,
@@ -81,7 +148,6 @@ class KnowledgeBaseApp:
             font=("Arial", 20),
             wraplength=1100
         )
-        self.instructions_label.place(relx=0.5, rely=0.465, anchor="center")
 
         self.start_button = tk.Button(
             self.main_frame,
@@ -93,7 +159,6 @@ class KnowledgeBaseApp:
             padx=20,
             pady=10
         )
-        self.start_button.place(relx=0.5, rely=0.6, anchor="center")
         self.start_button.bind("<Enter>", self.on_enter_buttons)
         self.start_button.bind("<Leave>", self.on_leave_buttons)
 
@@ -193,6 +258,19 @@ class KnowledgeBaseApp:
         self.no_button.bind("<Enter>", self.on_enter_buttons)
         self.no_button.bind("<Leave>", self.on_leave_buttons)
 
+        self.dont_know_button = tk.Button(
+            self.answer_button_frame,
+            text="Don't know",
+            command=lambda: self.answer("Don't know"),
+            fg="black",
+            font=("Arial", 17),
+            relief="solid",
+            padx=30,
+            pady=15
+        )
+        self.dont_know_button.bind("<Enter>", self.on_enter_buttons)
+        self.dont_know_button.bind("<Leave>", self.on_leave_buttons)
+
         self.animal_group_label = tk.Label(
             self.main_frame,
             text="Current Animal Group: None",
@@ -205,6 +283,8 @@ class KnowledgeBaseApp:
         self.animal_group_label.place(relx=0.01, rely=0.05)
         self.animal_group_label.place_forget()
 
+        self.show_welcome_screen()
+
     def show_instructions(self) -> None:
         instructions_window = tk.Toplevel(self.root)
         instructions_window.title("Instructions")
@@ -236,47 +316,46 @@ class KnowledgeBaseApp:
             instruction_label.pack(pady=5)
 
     def open_dictionary(self) -> None:
-        dictionary_window = tk.Toplevel(self.root)
-        dictionary_window.title("Dictionary")
-        dictionary_window.geometry(f"700x600+{self.root.winfo_x()+680}+{self.root.winfo_y()+150}")
-
-        scrollable_frame = tk.Frame(dictionary_window)
-        scrollable_frame.pack(fill="both", expand=True)
-
-        canvas = tk.Canvas(scrollable_frame)
-        scrollbar = tk.Scrollbar(scrollable_frame, orient="vertical", command=canvas.yview)
-        frame_content = tk.Frame(canvas)
-
-        frame_content.bind(
-            "<Configure>",
-            lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
-        )
-
-        canvas.create_window((0, 0), window=frame_content, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-
-        for entry in self.dictionary:
-            term_label = tk.Label(frame_content, text=f"{entry['Term']}", font=("Arial", 14, "bold"), anchor="w")
-            definition_label = tk.Label(frame_content, text=f"{entry['Definition']}", font=("Arial", 12), wraplength=550, anchor="w", justify="left")
-            term_label.pack(fill="x", pady=5)
-            definition_label.pack(fill="x", pady=(0, 10))
+        # The window and its search index are built on first use and reused afterwards
+        if self.dictionary_window is None:
+            self.dictionary_window = DictionaryWindow(self.root, DictionaryIndex(self.dictionary))
+        self.dictionary_window.show(f"700x600+{self.root.winfo_x()+680}+{self.root.winfo_y()+150}")
 
     def show_classification_tree(self) -> None:
-        img_path = "Images/animal tree.png"
-        img = Image.open(img_path)
-        img = img.resize((600, 600))
-        
-        img_window = Toplevel(self.root)
-        img_window.title("Classification Tree")
-        img_window.geometry("600x600+10+100")
-        
-        tk_img = ImageTk.PhotoImage(img)
-        img_label = Label(img_window, image=tk_img)
-        img_label.image = tk_img
-        img_label.pack()
+        # Zoomable viewer over a tile pyramid on disk; the window is reused afterwards. If the
+        # pyramid is not ready yet, the window opens as soon as the worker has built it.
+        if self.tree_viewer is None:
+            if self.tree_pyramid is None:
+                self._show_tree_when_built = True
+                self.prepare_tree_pyramid()
+                return
+            self.tree_viewer = TreeViewer(self.root, self.tree_pyramid)
+        self.tree_viewer.show("600x600+10+100")
+
+    def prepare_tree_pyramid(self) -> None:
+        # Builds the pyramid on a loader worker (a 3661x4223 image takes over a second) unless it
+        # is on disk already, e.g. from the "thumbnails" command; called at startup and after the
+        # tree image changes
+        if self._tree_build is not None or self.tree_pyramid is not None:
+            return
+        build = self._tree_build = object()
+        self.image_loader.run(build_pyramid, TREE_IMAGE_PATH,
+                              callback=lambda future: self._tree_pyramid_built(build, future))
+
+    def _tree_pyramid_built(self, build, future) -> None:
+        if build is not self._tree_build:
+            # The tree image changed while this build ran; a new one has been started
+            return
+        self._tree_build = None
+        try:
+            self.tree_pyramid = TilePyramid(future.result()[0])
+        except (OSError, ValueError) as error:
+            print(f"Error: Could not build the classification tree tiles: {error}")
+            self._show_tree_when_built = False
+            return
+        if self._show_tree_when_built:
+            self._show_tree_when_built = False
+            self.show_classification_tree()
 
     def update_animal_group_label(self, label) -> None:
         vowels = ('a', 'e', 'i', 'o', 'u')
@@ -299,30 +378,29 @@ class KnowledgeBaseApp:
         self.answer_button_frame.place(relx=0.5, rely=0.6, anchor="center")
         self.yes_button.pack(side="left", padx=40)
         self.no_button.pack(side="right", padx=40)
-        self.current_rule_index = 0
+        self.dont_know_button.pack(side="left", padx=40)
+        self.session.start()
+        self.session_logged = False
         self.display_next_question()
 
     def display_next_question(self) -> None:
-        if self.current_rule_index is not None and self.current_rule_index < len(self.rules):
-            self.current_question = self.rules[self.current_rule_index]
-            self.current_feature_index = 0
-            # print(f"Displaying question for rule: {self.current_question['current animal group']}")
-
-            if "required features" in self.current_question:
-                self.ask_feature_question()
-            elif "end classification" in self.current_question:
-                # Directly end classification if this is a terminal group
-                self.end_classification(self.current_question["current animal group"])
-            else:
-                print(f"Error: No 'required features' or 'end classification' in rule for {self.current_question['current animal group']}.")
+        if not self.session.finished:
+            # Warm up the example images of the groups this rule can still lead to, once the
+            # question is on screen and "Animal media" has been parsed
+            if self.media_loaded():
+                self.root.after_idle(self.prefetcher.prefetch_from, self.session.node_index, branch_statistics,
+                                     self.session.graph)
+            self.ask_feature_question()
+        elif self.session.node.message is None and self.session.graph.is_rule(self.session.node_index):
+            print(f"Error: No 'required features' or 'end classification' in rule for {self.session.result}.")
         else:
-            # print("No valid rule found. Ending classification with 'Unknown classification'.")
-            self.end_classification("Unknown classification")
+            # Directly end classification if this is a terminal group
+            self.log_session()
+            self.end_classification(self.session.result)
 
     def ask_feature_question(self) -> None:
-        feature_name = self.current_question["required features"][self.current_feature_index]
-        question_text = self.get_question_text(feature_name)
-        # print(f"Asking question: {question_text} (Feature: {feature_name})")
+        question_text = self.session.question_text()
+        # print(f"Asking question: {question_text} (Feature: {self.session.current_feature()})")
         if len(question_text.split()) > 15:
             font_style = ("Arial", 33, "bold")
         else:
@@ -330,65 +408,106 @@ class KnowledgeBaseApp:
         self.question_label.config(text=question_text, font=font_style)
 
     def get_question_text(self, feature_name) -> str:
-        for group in self.knowledge_base:
-            for feature in group["features"]:
-                if feature["name"] == feature_name:
-                    # print(f"Question text for feature '{feature_name}' found: {feature['question']}")
-                    return feature.get("question", "No question available.")
-        # print(f"No question text found for feature '{feature_name}'.")
-        return "No question available."
+        return self.graph.question_for(feature_name)
 
     def answer(self, user_input) -> None:
-        feature_name = self.current_question["required features"][self.current_feature_index]
-        self.answers[feature_name] = (user_input == "Yes")
-        # print(f"Answer received for feature '{feature_name}': {self.answers[feature_name]}")
-        self.current_feature_index += 1
-
-        if self.current_feature_index < 2:
-            self.ask_feature_question()
-        elif self.current_feature_index == 2:
-            yes_count = sum(self.answers.get(feature, False) for feature in self.current_question["required features"][:2])
-            # print(f"First two features yes count: {yes_count}")
-            if yes_count == 2:
-                self.update_animal_group_label(self.current_question['current animal group'])
-                self.check_subcategories(self.current_question["new direction"])
-            elif yes_count == 1:
-                self.ask_feature_question()  # Ask the third question
+        node_index = self.session.node_index
+        # "Don't know" makes the session follow both branches of rules it leaves undecided
+        decision = self.session.answer(None if user_input == "Don't know" else user_input == "Yes")
+
+        if decision is not None and self.session.graph is self.graph:
+            branch_statistics.record(node_index, decision)
+        if decision is not None or self.session.branches is not None:
+            # After "Don't know" the followed branch can move to another subtree without a decision
+            label = self.session.label()
+            if label is None:
+                self.animal_group_label.place_forget()
             else:
-                if self.current_question['current animal group'] == "vertebrates":
-                    self.update_animal_group_label("invertebrates")
-                self.go_to_next_rule(self.current_question["else"])
-        else:
-            if self.answers[feature_name]:  # Third question is "Yes"
-                self.update_animal_group_label(self.current_question['current animal group'])
-                self.check_subcategories(self.current_question["new direction"])
-            else:  # Third question is "No"
-                if self.current_question['current animal group'] == "vertebrates":
-                    self.update_animal_group_label("invertebrate")
-                self.go_to_next_rule(self.current_question["else"])
-
-    def check_subcategories(self, group) -> None:
-        # print(f"Checking subcategories for group: {group}")
-        subcategory_rule_index = next(
-            (index for index, rule in enumerate(self.rules) if rule["current animal group"] == group),
-            None
-        )
-        if subcategory_rule_index is not None:
-            # print(f"Subcategories found. Transitioning to rule: {group}")
-            self.current_rule_index = subcategory_rule_index
-            self.display_next_question()
-        else:
-            # print(f"No subcategories found. Ending classification for group: {group}")
-            self.end_classification(group)
-
-    def go_to_next_rule(self, next_group) -> None:
-        # print(f"Moving to next rule: {next_group}")
-        self.current_rule_index = next(
-            (index for index, rule in enumerate(self.rules) if rule["current animal group"] == next_group),
-            None
-        )
+                self.update_animal_group_label(label)
+
+        if decision is None and not self.session.finished:
+            self.ask_feature_question()  # Ask the next (or the tie-breaking third) question
+            return
         self.display_next_question()
 
+    def apply_knowledge_update(self, update) -> None:
+        # Swaps in a reloaded knowledge base (see hot_reload.py). New sessions use the new rule
+        # graph; a session in progress finishes on the graph it started with.
+        old_graph = self.graph
+        if update.graph is not old_graph:
+            nodes = node_map(old_graph, update.graph)
+            feature_order = self.engine.feature_order
+            if feature_order:
+                feature_order = {nodes[node_index]: order for node_index, order in feature_order.items()
+                                 if node_index in nodes}
+            self.graph = update.graph
+            self.engine = ClassificationEngine(self.graph, feature_order, branch_statistics)
+            self.prefetcher.graph = self.graph
+            branch_statistics.remap(nodes)
+            if self.session.started_at is None:
+                self.session = self.engine.new_session()
+
+        data = update.data
+        self.knowledge_base = data["Knowledge base"]
+        self.rules = data["Rules"]
+        if "Animal media" in update.changed_sections:
+            self.animal_media = data.get("Animal media", {})
+            self._media_index = None
+        if "Instructions" in update.changed_sections:
+            self.instructions = data.get("Instructions", "")
+        if "Dictionary" in update.changed_sections:
+            self.dictionary = data.get("Dictionary", [])
+            if self.dictionary_window is not None:
+                self.dictionary_window.set_index(DictionaryIndex(self.dictionary))
+
+        print(f"Reloaded knowledge base: {', '.join(sorted(update.changed_sections))} changed, "
+              f"{len(update.changed_groups)} rule group(s) recompiled")
+
+    def invalidate_images(self, changed_images) -> None:
+        # changed_images maps image paths to their previous (mtime, size), None for new files
+        for source, previous_state in changed_images.items():
+            image_cache.invalidate(source)
+            if previous_state is not None:
+                remove_thumbnails(source, previous_state[0])
+                remove_pyramid(source, previous_state[0])
+            if source == TREE_IMAGE_PATH:
+                if self.tree_viewer is not None:
+                    self.tree_viewer.window.destroy()
+                    self.tree_viewer = None
+                # Rebuild now, off the main thread, so the next click doesn't wait for it
+                self.tree_pyramid = None
+                self._tree_build = None
+                self.prepare_tree_pyramid()
+
+    def media_loaded(self) -> bool:
+        # "Animal media" is the last section of knowledge_base.json, so parsing it also parses
+        # Facts, Instructions and Dictionary. A lazy section is parsed on a loader worker, and
+        # prefetching is skipped until it is done, so the Tk thread doesn't parse any of them.
+        if not isinstance(self.animal_media, LazySection) or self.animal_media.loaded:
+            return True
+        if not self._media_loading:
+            self._media_loading = True
+            self.image_loader.run(self.animal_media.value, callback=self._media_parsed)
+        return False
+
+    def _media_parsed(self, future) -> None:
+        self._media_loading = False
+        try:
+            future.result()
+        except (OSError, ValueError) as error:
+            print(f"Error: Could not read 'Animal media': {error}")
+            return
+        if not self.session.finished and self.session.node_index is not None:
+            self.prefetcher.prefetch_from(self.session.node_index, branch_statistics, self.session.graph)
+
+    def media_for_group(self, classification_group):
+        if self._media_index is None:
+            self._media_index = {}
+            for group in self.animal_media:
+                for name, media in group.items():
+                    self._media_index.setdefault(name, media)
+        return self._media_index.get(" ".join(classification_group.split(" ")[1:]))
+
     def display_animal_images(self, group_name, message_frame) -> None:
         for group in self.animal_media:
             if group_name in group:
@@ -412,15 +531,24 @@ class KnowledgeBaseApp:
 
                 images_frame = tk.Frame(self.main_frame, bg="#A5D6A7", width=800, height=400)
                 images_frame.place(relx=0.5, rely=0.5 + (message_frame_height / self.main_frame.winfo_height()) - 0.2, anchor="n")
+                self.result_widgets.append(images_frame)
+
+                # Blank placeholder of the final size until the worker thread has decoded the image
+                placeholder = tk.PhotoImage(master=self.root, width=ANIMAL_IMAGE_SIZE[0], height=ANIMAL_IMAGE_SIZE[1])
 
                 x_pos, y_pos = 50, 0
                 for animal in media["Images"]:
-                    img = Image.open(animal["File"]).resize((200, 200))
-                    photo = ImageTk.PhotoImage(img)
-                    img_label = Label(images_frame, image=photo, bg="#A5D6A7")
-                    img_label.image = photo
+                    img_label = Label(images_frame, image=placeholder, text="Loading...", compound="center", bg="#A5D6A7")
+                    img_label.image = placeholder
                     img_label.place(x=x_pos, y=y_pos)
 
+                    def show_image(photo, img_label=img_label):
+                        if img_label.winfo_exists():
+                            img_label.config(image=photo, text="")
+                            img_label.image = photo
+
+                    self.image_loader.request(animal["File"], ANIMAL_IMAGE_SIZE, show_image)
+
                     def on_enter(event, name=animal["Name"], fact=animal["Fact"]):
                         hover_label = Label(images_frame, text=f"{name}: {fact}", bg="#FFF", fg="black", font=("Arial", 12))
                         hover_label.place(x=min(event.x_root - images_frame.winfo_rootx() + 10, images_frame.winfo_width() - hover_label.winfo_reqwidth() - 10),
@@ -440,87 +568,361 @@ class KnowledgeBaseApp:
 
     def end_classification(self, classification_group) -> None:
         # print(f"Ending classification. Group: {classification_group}")
-        rule_found = False
+        candidates = self.session.candidates
+        if candidates is not None and len(candidates) > 1:
+            self.show_candidates(candidates)
+            return
 
-        for rule in self.rules:
-            if rule["current animal group"] == classification_group and "end classification" in rule:
-                rule_found = True
-                self.animal_group_label.place_forget()
-                self.yes_button.pack_forget()
-                self.no_button.pack_forget()
-                self.question_label.place_forget()
-
-                end_message = rule["end classification"]
-                main_message = end_message.split("\n")[0]
-                secondary_message = end_message.split("\n")[1]
-                group_name = " ".join(classification_group.split(" ")[1:])
-
-                message_frame = tk.Frame(self.main_frame, bg='#A5D6A7')
-                message_frame.place(relx=0.5, rely=0.45, anchor="center")
-
-                if len(main_message.split()) <= 10:
-                    main_label = tk.Label(
-                        message_frame,
-                        text=main_message,
-                        bg='#A5D6A7',
-                        fg='black',
-                        font=("Arial", 40, "bold"),
-                        wraplength=1200
-                    )
-                    main_label.pack()
-
-                    secondary_label = tk.Label(
-                        message_frame,
-                        text=secondary_message,
-                        bg='#A5D6A7',
-                        fg='#555555',
-                        font=("Arial", 30),
-                        wraplength=1200
-                    )
-                    secondary_label.pack(pady=(10, 0))
-                else:
-                    main_label = tk.Label(
-                        message_frame,
-                        text=secondary_message,
-                        bg='#A5D6A7',
-                        fg='black',
-                        font=("Arial", 30, "bold"),
-                        wraplength=1200
-                    )
-                    main_label.pack()
-
-                    secondary_label = tk.Label(
-                        message_frame,
-                        text=main_message,
-                        bg='#A5D6A7',
-                        fg='#555555',
-                        font=("Arial", 20),
-                        wraplength=1000
-                    )
-                    secondary_label.pack(pady=(10, 0))
-
-                self.display_animal_images(group_name, message_frame)
-            
-            if rule_found == True:
-                break
+        node = self.session.graph.node_for(classification_group)
 
+        if node is None or node.message is None:
+            return
 
-def main() -> None:
-    with open('knowledge_base.json', 'r') as file:
-        knowledge_data = json.load(file)
+        self.animal_group_label.place_forget()
+        self.yes_button.pack_forget()
+        self.dont_know_button.pack_forget()
+        self.no_button.pack_forget()
+        self.question_label.place_forget()
+
+        end_message = node.message
+        main_message = end_message.split("\n")[0]
+        secondary_message = end_message.split("\n")[1]
+        group_name = " ".join(classification_group.split(" ")[1:])
+
+        message_frame = tk.Frame(self.main_frame, bg='#A5D6A7')
+        message_frame.place(relx=0.5, rely=0.45, anchor="center")
+        self.result_widgets.append(message_frame)
+
+        if len(main_message.split()) <= 10:
+            main_label = tk.Label(
+                message_frame,
+                text=main_message,
+                bg='#A5D6A7',
+                fg='black',
+                font=("Arial", 40, "bold"),
+                wraplength=1200
+            )
+            main_label.pack()
+
+            secondary_label = tk.Label(
+                message_frame,
+                text=secondary_message,
+                bg='#A5D6A7',
+                fg='#555555',
+                font=("Arial", 30),
+                wraplength=1200
+            )
+            secondary_label.pack(pady=(10, 0))
+        else:
+            main_label = tk.Label(
+                message_frame,
+                text=secondary_message,
+                bg='#A5D6A7',
+                fg='black',
+                font=("Arial", 30, "bold"),
+                wraplength=1200
+            )
+            main_label.pack()
+
+            secondary_label = tk.Label(
+                message_frame,
+                text=main_message,
+                bg='#A5D6A7',
+                fg='#555555',
+                font=("Arial", 20),
+                wraplength=1000
+            )
+            secondary_label.pack(pady=(10, 0))
+
+        self.display_animal_images(group_name, message_frame)
+
+
+    def candidate_name(self, classification_group) -> str:
+        node = self.session.graph.node_for(classification_group)
+        if node is None or node.message is None:
+            return classification_group
+        return " ".join(classification_group.split(" ")[1:])
+
+    def show_candidates(self, candidates) -> None:
+        # The groups that fit the answers, most likely first; only the top few load example images
+        self.animal_group_label.place_forget()
+        self.yes_button.pack_forget()
+        self.dont_know_button.pack_forget()
+        self.no_button.pack_forget()
+        self.question_label.place_forget()
+
+        message_frame = tk.Frame(self.main_frame, bg='#A5D6A7')
+        message_frame.place(relx=0.5, rely=0.3, anchor="center")
+        self.result_widgets.append(message_frame)
+
+        title_label = tk.Label(
+            message_frame,
+            text="Your animal is one of these groups:",
+            bg='#A5D6A7',
+            fg='black',
+            font=("Arial", 36, "bold"),
+            wraplength=1200
+        )
+        title_label.pack()
+
+        for rank, (group, probability) in enumerate(candidates[:self.CANDIDATES_SHOWN], 1):
+            candidate_label = tk.Label(
+                message_frame,
+                text=f"{rank}. {self.candidate_name(group)} ({probability:.0%})",
+                bg='#A5D6A7',
+                fg='black' if rank == 1 else '#555555',
+                font=("Arial", 26 if rank == 1 else 22)
+            )
+            candidate_label.pack(pady=(10, 0))
+
+        images_frame = tk.Frame(self.main_frame, bg="#A5D6A7")
+        images_frame.place(relx=0.5, rely=0.6, anchor="n")
+        self.result_widgets.append(images_frame)
+
+        placeholder = tk.PhotoImage(master=self.root, width=ANIMAL_IMAGE_SIZE[0], height=ANIMAL_IMAGE_SIZE[1])
+        for group, _ in candidates[:self.CANDIDATES_WITH_IMAGES]:
+            media = self.media_for_group(group)
+            if media is None or not media["Images"]:
+                continue
+            animal = media["Images"][0]
+
+            column_frame = tk.Frame(images_frame, bg="#A5D6A7")
+            column_frame.pack(side="left", padx=10)
+            img_label = Label(column_frame, image=placeholder, text="Loading...", compound="center", bg="#A5D6A7")
+            img_label.image = placeholder
+            img_label.pack()
+            caption_label = tk.Label(column_frame, text=f"{self.candidate_name(group)}: {animal['Name']}",
+                                     bg="#A5D6A7", fg="black", font=("Arial", 14), wraplength=220)
+            caption_label.pack(pady=(5, 0))
+
+            def show_image(photo, img_label=img_label):
+                if img_label.winfo_exists():
+                    img_label.config(image=photo, text="")
+                    img_label.image = photo
 
-    knowledge_base = knowledge_data["Knowledge base"]
-    rules = knowledge_data["Rules"]
-    dictionary_data = knowledge_data["Dictionary"]
-    animal_media = knowledge_data.get("Animal media", {})
-    instructions = knowledge_data.get("Instructions", "")
+            self.image_loader.request(animal["File"], ANIMAL_IMAGE_SIZE, show_image)
+
+
+def main(session_log_dir=SESSION_LOG_DIR, adaptive_questions=False, metrics_file=None, hot_reload=False,
+         launch_time=None) -> None:
+    start_time = time.perf_counter()
+    launch_time = start_time if launch_time is None else launch_time
+
+    # A compiled knowledge base (see the "compile" command) is used when it is newer than the JSON.
+    # Otherwise only the rules and question texts are parsed before the first screen. The other
+    # sections are LazySections: parsed on the Tk thread when the dictionary, instructions or
+    # result screen first need them, or on a loader worker for the image prefetch (see media_loaded).
+    knowledge_source = load_compiled_if_fresh('knowledge_base.json')
+    if knowledge_source is not None:
+        knowledge_base, rules, graph = None, None, knowledge_source.graph
+    else:
+        knowledge_source = KnowledgeFile('knowledge_base.json')
+        knowledge_base = knowledge_source.section("Knowledge base")
+        rules = knowledge_source.section("Rules")
+        graph = None
+    dictionary_data = LazySection(knowledge_source, "Dictionary")
+    animal_media = LazySection(knowledge_source, "Animal media", {})
+    instructions = LazySection(knowledge_source, "Instructions", "")
+    load_time = time.perf_counter() - start_time
+
+    feature_order = None
+    if adaptive_questions:
+        # Ask each rule's most-likely-to-agree pair of questions first, based on the session log
+        graph = graph if graph is not None else compile_rule_graph(knowledge_base, rules)
+        feature_order = AnswerStatistics.from_sessions(graph, read_sessions(session_log_dir)).feature_order()
 
     root = tk.Tk()
-    KnowledgeBaseApp(root, knowledge_base, rules, dictionary_data, animal_media, instructions)
+    metrics = Metrics() if metrics_file else None
+    app = KnowledgeBaseApp(root, knowledge_base, rules, dictionary_data, animal_media, instructions, graph,
+                           SessionLogger(session_log_dir), feature_order, metrics)
+    reloader = None
+    if hot_reload:
+        # Picks up edits to knowledge_base.json and Images/ without restarting
+        reloader = HotReloader(app, 'knowledge_base.json')
+        reloader.start()
+    if metrics is not None:
+        # F12 toggles the overlay; the metrics are also written to metrics_file periodically
+        start_metrics(root, metrics, metrics_file)
+
+    def report_startup():
+        now = time.perf_counter()
+        print(f"Startup: first screen after {(now - launch_time) * 1000:.0f} ms since launch "
+              f"({(now - start_time) * 1000:.0f} ms in main, {load_time * 1000:.1f} ms loading the knowledge base)")
+
+    root.after_idle(report_startup)
+    root.after_idle(app.prepare_tree_pyramid)
 
     # Ensuring the Tkinter event loop is properly handled in macOS
     root.mainloop()
 
+    if reloader is not None:
+        reloader.shutdown()
+    if metrics is not None:
+        write_snapshot(metrics.snapshot(), metrics_file)
+
+
+def compile_knowledge_base(json_path, output_path=None) -> None:
+    start_time = time.perf_counter()
+    with open(json_path, 'r') as file:
+        knowledge_data = json.load(file)
+
+    errors = validate_knowledge_data(knowledge_data, extra_images=[TREE_IMAGE_PATH])
+    if errors:
+        for error in errors:
+            print(f"Error: {error}", file=sys.stderr)
+        sys.exit(f"{json_path}: {len(errors)} problem(s) found, nothing was compiled")
+
+    output_path = output_path or compiled_path(json_path)
+    size = write_compiled(knowledge_data, output_path)
+    print(f"Compiled {len(knowledge_data['Rules'])} rules into {output_path} ({size} bytes) "
+          f"in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+
+def query_paths(json_path, reach_groups, answer_args, answers_file) -> None:
+    from batch import load_engine, parse_value
+    from path_index import PathIndex
+
+    index = PathIndex(load_engine(json_path).graph)
+    for group in reach_groups:
+        print(index.describe_requirements(group))
+
+    if answer_args:
+        answers = {}
+        for argument in answer_args:
+            name, separator, value = argument.rpartition("=")
+            if not separator:
+                sys.exit(f"Error: --answer expects FEATURE=yes|no, got '{argument}'")
+            answers[name.strip()] = parse_value(value)
+        for group in index.consistent_groups(answers):
+            print(group)
+
+    if answers_file:
+        lines = sys.stdin if answers_file == "-" else open(answers_file, "r", encoding="utf-8")
+        with lines:
+            for line in lines:
+                if line.strip():
+                    answers = {name: parse_value(value) for name, value in json.loads(line).items()}
+                    print(json.dumps({"groups": index.consistent_groups(answers)}))
+
+    if not (reach_groups or answer_args or answers_file):
+        print(f"{len(index.paths)} paths to {len(index.group_paths)} groups over {len(index.feature_groups)} features")
+        for group, path_ids in index.group_paths.items():
+            print(f"  {group}: {', '.join(str(len(index.paths[path_id].steps)) for path_id in path_ids)} rule(s)")
+
+
+def build_arg_parser(with_commands=True) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Animal Classification System")
+    parser.add_argument("--image-cache-mb", type=int, default=64, help="Memory budget of the decoded image cache")
+    parser.add_argument("--session-log-dir", default=SESSION_LOG_DIR, help="Directory of the session log")
+    parser.add_argument("--adaptive-questions", action="store_true",
+                        help="Order each rule's questions by the answer statistics in the session log")
+    parser.add_argument("--hot-reload", action="store_true",
+                        help="Reload knowledge_base.json and Images/ when they change, without restarting")
+    parser.add_argument("--metrics", nargs="?", const="metrics.json", default=None, metavar="FILE",
+                        help="Time the hot paths, show them with F12 and export them to FILE (default: metrics.json)")
+    if not with_commands:
+        return parser
+    commands = parser.add_subparsers(dest="command")
+
+    classify_parser = commands.add_parser("classify", help="Classify a CSV/JSONL file of feature answers")
+    classify_parser.add_argument("input", help="CSV (header of feature names) or JSONL file, '-' for stdin")
+    classify_parser.add_argument("-o", "--output", default="-", help="Output file (.csv or .jsonl), '-' for stdout")
+    classify_parser.add_argument("--knowledge-base", default="knowledge_base.json")
+    classify_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    classify_parser.add_argument("--chunk-size", type=int, default=10000, help="Rows per worker task")
+    classify_parser.add_argument("--input-format", choices=("csv", "jsonl"), default=None)
+    classify_parser.add_argument("--output-format", choices=("csv", "jsonl"), default=None)
+
+    thumbnails_parser = commands.add_parser("thumbnails", help="Pre-generate the image thumbnail cache")
+    thumbnails_parser.add_argument("--knowledge-base", default="knowledge_base.json")
+    thumbnails_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+
+    compile_parser = commands.add_parser("compile", help="Validate the knowledge base and write the binary artifact")
+    compile_parser.add_argument("--knowledge-base", default="knowledge_base.json")
+    compile_parser.add_argument("-o", "--output", default=None, help="Artifact path (default: next to the JSON, .kbc)")
+
+    stats_parser = commands.add_parser("question-stats", help="Report expected and observed questions per classification")
+    stats_parser.add_argument("--knowledge-base", default="knowledge_base.json")
+    # Also accepted after the command; SUPPRESS keeps the top-level value when it is not given here
+    stats_parser.add_argument("--session-log-dir", default=argparse.SUPPRESS, help="Directory of the session log")
+
+    paths_parser = commands.add_parser("paths", help="Query which answers lead to which groups")
+    paths_parser.add_argument("--knowledge-base", default="knowledge_base.json")
+    paths_parser.add_argument("--reach", action="append", default=[], metavar="GROUP",
+                              help="Show what must be true to reach GROUP (repeatable)")
+    paths_parser.add_argument("--answer", action="append", default=[], metavar="FEATURE=yes|no",
+                              help="A known answer; prints the groups still possible (repeatable)")
+    paths_parser.add_argument("--answers-file", default=None,
+                              help="JSONL file of partial answer objects ('-' for stdin); prints the possible groups per line")
+
+    serve_parser = commands.add_parser("serve", help="Serve classification sessions over localhost HTTP")
+    serve_parser.add_argument("--knowledge-base", default="knowledge_base.json")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--unix-socket", default=None, help="Listen on this Unix socket instead of TCP")
+    serve_parser.add_argument("--session-ttl", type=float, default=900, help="Seconds before an idle session expires")
+    serve_parser.add_argument("--no-session-log", action="store_true", help="Do not log the served sessions")
+    serve_parser.add_argument("--session-log-dir", default=argparse.SUPPRESS, help="Directory of the session log")
+
+    loadtest_parser = commands.add_parser("loadtest", help="Load-test a running classification service")
+    loadtest_parser.add_argument("--host", default="127.0.0.1")
+    loadtest_parser.add_argument("--port", type=int, default=8765)
+    loadtest_parser.add_argument("--unix-socket", default=None)
+    loadtest_parser.add_argument("--clients", type=int, default=100, help="Concurrent connections")
+    loadtest_parser.add_argument("--sessions", type=int, default=10000, help="Sessions to classify in total")
+    loadtest_parser.add_argument("--duration", type=float, default=30.0, help="Stop after this many seconds")
+
+    parser.command_names = frozenset(commands.choices)
+    return parser
+
+
+def cli(argv=None) -> None:
+    launch_time = time.perf_counter()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = build_arg_parser()
+    if parser.command_names & set(argv):
+        args = parser.parse_args(argv)
+    else:
+        # No command starts the GUI. Interactive windows such as an IPython kernel pass arguments
+        # of their own (e.g. "-f <kernel.json>"), so unknown ones are ignored rather than fatal.
+        args, ignored = build_arg_parser(with_commands=False).parse_known_args(argv)
+        args.command = None
+        if ignored:
+            print(f"Ignoring unrecognised arguments: {' '.join(ignored)}", file=sys.stderr)
+    image_cache.configure(args.image_cache_mb * 1024 * 1024)
+
+    if args.command == "classify":
+        from batch import run_batch
+
+        run_batch(args.input, args.output, args.knowledge_base, args.workers, args.chunk_size,
+                  args.input_format, args.output_format)
+    elif args.command == "thumbnails":
+        from thumbnails import pregenerate_thumbnails
+
+        with open(args.knowledge_base, 'r') as file:
+            animal_media = json.load(file).get("Animal media", [])
+        pregenerate_thumbnails(animal_media, workers=args.workers)
+    elif args.command == "compile":
+        compile_knowledge_base(args.knowledge_base, args.output)
+    elif args.command == "question-stats":
+        from batch import load_engine
+
+        graph = load_engine(args.knowledge_base).graph
+        print(question_report(AnswerStatistics.from_sessions(graph, read_sessions(args.session_log_dir))))
+    elif args.command == "paths":
+        query_paths(args.knowledge_base, args.reach, args.answer, args.answers_file)
+    elif args.command == "serve":
+        from service import run_service
+
+        session_logger = None if args.no_session_log else SessionLogger(args.session_log_dir)
+        run_service(args.knowledge_base, args.host, args.port, args.unix_socket, session_logger, args.session_ttl)
+    elif args.command == "loadtest":
+        from service import run_load_test
+
+        run_load_test(args.host, args.port, args.unix_socket, args.clients, args.sessions, args.duration)
+    else:
+        main(args.session_log_dir, args.adaptive_questions, args.metrics, args.hot_reload, launch_time)
+
 
 if __name__ == "__main__":
-    main()
+    cli(sys.argv[1:])
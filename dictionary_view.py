@@ -0,0 +1,235 @@
+import math
+import re
+import tkinter as tk
+import tkinter.font
+
+
+TOKEN = re.compile(r"\w+")
+MAX_PREFIX = 8
+
+
+def tokenize(text) -> list:
+    return TOKEN.findall(text.lower())
+
+
+class DictionaryIndex:
+    # Prefix index over the tokens of every term and definition, built once. Prefixes are
+    # indexed up to MAX_PREFIX characters; longer query tokens are checked against the
+    # candidates' own tokens.
+    def __init__(self, entries) -> None:
+        self.entries = list(entries)
+        self._prefixes = {}
+        self._tokens = []
+        self._term_tokens = []
+
+        for entry_id, entry in enumerate(self.entries):
+            term_tokens = set(tokenize(entry["Term"]))
+            tokens = term_tokens | set(tokenize(entry["Definition"]))
+            self._term_tokens.append(term_tokens)
+            self._tokens.append(tokens)
+            for token in tokens:
+                for length in range(1, min(len(token), MAX_PREFIX) + 1):
+                    self._prefixes.setdefault(token[:length], set()).add(entry_id)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def search(self, query) -> list:
+        # Entries whose terms or definitions have a word starting with every query word;
+        # term matches come first, otherwise the dictionary order is kept
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            return list(range(len(self.entries)))
+
+        matches = None
+        for token in sorted(query_tokens, key=len, reverse=True):
+            candidates = self._prefixes.get(token[:MAX_PREFIX], set())
+            if len(token) > MAX_PREFIX:
+                candidates = {entry_id for entry_id in candidates
+                              if any(word.startswith(token) for word in self._tokens[entry_id])}
+            matches = candidates if matches is None else matches & candidates
+            if not matches:
+                return []
+
+        def in_term(entry_id) -> bool:
+            return all(any(word.startswith(token) for word in self._term_tokens[entry_id]) for token in query_tokens)
+
+        return sorted(matches, key=lambda entry_id: (not in_term(entry_id), entry_id))
+
+
+class DictionaryWindow:
+    # Searchable dictionary that only creates widgets for the rows that fit on screen and
+    # reuses them while scrolling. Each row is as tall as its wrapped definition, measured with
+    # the label fonts the first time the entry is shown. The window is hidden instead of
+    # destroyed when closed.
+    WRAP_LENGTH = 550
+    # Space above the term plus a margin below the definition
+    ROW_PADDING = 15
+
+    def __init__(self, root, index) -> None:
+        self.root = root
+        self.index = index
+        self.matches = list(range(len(index)))
+        self.first_row = 0
+        self.rows = []
+        self.term_font = tk.font.Font(root=root, family="Arial", size=14, weight="bold")
+        self.definition_font = tk.font.Font(root=root, family="Arial", size=12)
+        self._row_heights = {}
+        self._word_widths = {}
+
+        self.window = tk.Toplevel(root)
+        self.window.title("Dictionary")
+        self.window.protocol("WM_DELETE_WINDOW", self.window.withdraw)
+
+        self.search_text = tk.StringVar()
+        self.search_text.trace_add("write", lambda *args: self.search())
+        search_frame = tk.Frame(self.window)
+        search_frame.pack(fill="x", padx=10, pady=(10, 5))
+        tk.Label(search_frame, text="Search:", font=("Arial", 12)).pack(side="left")
+        self.search_entry = tk.Entry(search_frame, textvariable=self.search_text, font=("Arial", 12))
+        self.search_entry.pack(side="left", fill="x", expand=True, padx=(5, 0))
+
+        self.result_label = tk.Label(self.window, text="", font=("Arial", 10), fg="#555555", anchor="w")
+        self.result_label.pack(fill="x", padx=10)
+
+        list_frame = tk.Frame(self.window)
+        list_frame.pack(fill="both", expand=True)
+        self.scrollbar = tk.Scrollbar(list_frame, orient="vertical", command=self.on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+        self.body = tk.Frame(list_frame)
+        self.body.pack(side="left", fill="both", expand=True)
+        self.body.bind("<Configure>", lambda event: self.render())
+
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.window.bind(sequence, self.on_mousewheel)
+
+        self.update_result_label()
+
+    def show(self, geometry) -> None:
+        self.window.geometry(geometry)
+        self.window.deiconify()
+        self.window.lift()
+        self.search_entry.focus_set()
+
+    def set_index(self, index) -> None:
+        self.index = index
+        self._row_heights = {}
+        self.search()
+
+    def search(self) -> None:
+        self.matches = self.index.search(self.search_text.get())
+        self.first_row = 0
+        self.update_result_label()
+        self.render()
+
+    def update_result_label(self) -> None:
+        self.result_label.config(text=f"{len(self.matches)} of {len(self.index)} terms")
+
+    def row_height(self, entry_id) -> int:
+        height = self._row_heights.get(entry_id)
+        if height is None:
+            lines = self.wrapped_lines(self.index.entries[entry_id]["Definition"])
+            height = self._row_heights[entry_id] = (self.ROW_PADDING + self.term_font.metrics("linespace")
+                                                    + lines * self.definition_font.metrics("linespace"))
+        return height
+
+    def wrapped_lines(self, text) -> int:
+        # Lines the definition label takes at WRAP_LENGTH: Tk wraps at spaces and breaks
+        # words wider than a line
+        space = self.word_width(" ")
+        lines = 0
+        for paragraph in text.split("\n"):
+            lines += 1
+            line_width = 0
+            for word in paragraph.split(" "):
+                width = self.word_width(word)
+                if line_width and line_width + space + width > self.WRAP_LENGTH:
+                    lines += 1
+                    line_width = 0
+                if width > self.WRAP_LENGTH:
+                    lines += math.ceil(width / self.WRAP_LENGTH) - 1
+                    width %= self.WRAP_LENGTH
+                line_width += (space if line_width else 0) + width
+        return lines
+
+    def word_width(self, word) -> int:
+        width = self._word_widths.get(word)
+        if width is None:
+            width = self._word_widths[word] = self.definition_font.measure(word)
+        return width
+
+    def visible_rows(self) -> int:
+        # Rows that fit on screen from first_row on, at least one
+        available = self.body.winfo_height()
+        rows = 0
+        for match_position in range(self.first_row, len(self.matches)):
+            available -= self.row_height(self.matches[match_position])
+            if available < 0:
+                break
+            rows += 1
+        return max(1, rows)
+
+    def last_start(self) -> int:
+        # The first row that still lets the last match be fully on screen
+        available = self.body.winfo_height()
+        start = len(self.matches)
+        while start > 0 and available >= self.row_height(self.matches[start - 1]):
+            available -= self.row_height(self.matches[start - 1])
+            start -= 1
+        return min(start, max(0, len(self.matches) - 1))
+
+    def scroll_to(self, first_row) -> None:
+        first_row = min(max(0, first_row), self.last_start())
+        if first_row != self.first_row:
+            self.first_row = first_row
+            self.render()
+
+    def on_scrollbar(self, action, amount, unit=None) -> None:
+        if action == "moveto":
+            self.scroll_to(round(float(amount) * len(self.matches)))
+        elif action == "scroll":
+            step = self.visible_rows() if unit == "pages" else 1
+            self.scroll_to(self.first_row + int(amount) * step)
+
+    def on_mousewheel(self, event) -> None:
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self.first_row - 1)
+        elif event.num == 5 or event.delta < 0:
+            self.scroll_to(self.first_row + 1)
+
+    def make_row(self) -> tuple:
+        frame = tk.Frame(self.body)
+        frame.pack_propagate(False)
+        term_label = tk.Label(frame, font=self.term_font, anchor="w")
+        definition_label = tk.Label(frame, font=self.definition_font, wraplength=self.WRAP_LENGTH, anchor="nw",
+                                    justify="left")
+        term_label.pack(fill="x", pady=(5, 0))
+        definition_label.pack(fill="both", expand=True)
+        return frame, term_label, definition_label
+
+    def render(self) -> None:
+        width = self.body.winfo_width()
+        available = self.body.winfo_height()
+        y = 0
+        position = 0
+        # Fill the body, including a last row that is only partly on screen
+        while y < available and self.first_row + position < len(self.matches):
+            if position == len(self.rows):
+                self.rows.append(self.make_row())
+            frame, term_label, definition_label = self.rows[position]
+            entry_id = self.matches[self.first_row + position]
+            entry = self.index.entries[entry_id]
+            term_label.config(text=entry["Term"])
+            definition_label.config(text=entry["Definition"])
+            height = self.row_height(entry_id)
+            frame.place(x=0, y=y, width=width, height=height)
+            y += height
+            position += 1
+        for frame, term_label, definition_label in self.rows[position:]:
+            frame.place_forget()
+
+        if self.matches:
+            self.scrollbar.set(self.first_row / len(self.matches),
+                               min(1.0, (self.first_row + self.visible_rows()) / len(self.matches)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
@@ -0,0 +1,386 @@
+import time
+from collections.abc import Mapping
+
+from rule_graph import UNKNOWN_CLASSIFICATION, compile_rule_graph
+
+
+# Open (non-terminal) branches kept after a "Don't know"; the least likely ones are dropped
+MAX_BRANCHES = 4
+
+
+def rule_decision(first, second, third=None):
+    # The first two answers decide unless they split 1-1, then the third one breaks the tie.
+    # Returns None while the tie-break answer is still needed.
+    if first == second:
+        return first
+    if third is None:
+        return None
+    return third
+
+
+def rule_outcome(graph, node_index, answers, feature_order=None, final=False) -> tuple:
+    # Evaluates a rule against answers that may be None ("Don't know") or missing (not asked yet).
+    # Returns (decision, None) once the known answers decide the majority, (None, position) when
+    # the feature at that position should be asked next, and (None, None) when no further answer
+    # can decide it. With final=True, missing answers count as "Don't know".
+    node = graph.nodes[node_index]
+    positions = (feature_order or {}).get(node_index) or range(len(node.feature_ids))
+    # Missing feature slots count as "No", as in rule_decision with fewer than three features
+    yes, no, unasked = 0, 3 - len(node.feature_ids), []
+    for position in positions:
+        name = graph.features[node.feature_ids[position]]
+        if name not in answers:
+            unasked.append(position)
+        elif answers[name] is True:
+            yes += 1
+        elif answers[name] is False:
+            no += 1
+
+    if yes >= 2:
+        return True, None
+    if no >= 2:
+        return False, None
+    if final or (yes + len(unasked) < 2 and no + len(unasked) < 2):
+        return None, None
+    return None, unasked[0]
+
+
+def expand_branches(graph, branches, answers, statistics=None, max_branches=MAX_BRANCHES, feature_order=None,
+                    final=False, parents=None) -> dict:
+    # Moves the probability mass of each branch (node index -> probability) forward as far as the
+    # answers allow. A rule the answers cannot decide sends its mass down both edges, split by
+    # statistics.probability (50/50 without statistics). Branches that reach the same node are
+    # merged, so a shared subtree is evaluated once however many paths lead into it. parents, if
+    # given, is updated with the node each reached node was last entered from.
+    for _ in range(len(graph.nodes) + 1):
+        expanded = {}
+        changed = False
+        for node_index, probability in branches.items():
+            node = graph.nodes[node_index]
+            if node.is_terminal:
+                expanded[node_index] = expanded.get(node_index, 0.0) + probability
+                continue
+
+            decision, position = rule_outcome(graph, node_index, answers, feature_order, final)
+            if position is not None:
+                expanded[node_index] = expanded.get(node_index, 0.0) + probability
+                continue
+            changed = True
+            if decision is not None:
+                children = ((node.yes if decision else node.no, probability),)
+            else:
+                yes_probability = statistics.probability(node_index, True) if statistics is not None else 0.5
+                children = ((node.yes, probability * yes_probability), (node.no, probability * (1 - yes_probability)))
+            for child, child_probability in children:
+                expanded[child] = expanded.get(child, 0.0) + child_probability
+                if parents is not None:
+                    parents[child] = node_index
+
+        branches = cap_branches(graph, expanded, max_branches)
+        if not changed:
+            return branches
+
+    raise ValueError("Rule graph has a cycle")
+
+
+def cap_branches(graph, branches, max_branches, keep=None) -> dict:
+    # Drops the least likely open branches beyond max_branches; keep is never dropped
+    open_branches = [node_index for node_index in branches
+                     if not graph.nodes[node_index].is_terminal and node_index != keep]
+    limit = max_branches - (keep is not None and keep in branches)
+    if len(open_branches) > limit:
+        open_branches.sort(key=lambda node_index: (-branches[node_index], node_index))
+        for node_index in open_branches[max(0, limit):]:
+            del branches[node_index]
+    return branches
+
+
+def merge_branches(first, second) -> dict:
+    merged = dict(first)
+    for node_index, probability in second.items():
+        merged[node_index] = merged.get(node_index, 0.0) + probability
+    return merged
+
+
+def path_label(graph, path):
+    # The group shown as "Your animal is a ..." after walking path: the last rule left through its
+    # "yes" edge, or "invertebrates" after the "no" edge of "vertebrates". None before either.
+    for parent, child in zip(reversed(path[:-1]), reversed(path[1:])):
+        node = graph.nodes[parent]
+        if child == node.yes:
+            return node.group
+        if node.group == "vertebrates":
+            return "invertebrates"
+    return None
+
+
+def rank_candidates(graph, branches) -> list:
+    # Terminal groups with their normalised probability, most likely first
+    totals = {}
+    for node_index, probability in branches.items():
+        group = graph.nodes[node_index].group
+        totals[group] = totals.get(group, 0.0) + probability
+    mass = sum(totals.values()) or 1.0
+    return sorted(((group, probability / mass) for group, probability in totals.items()),
+                  key=lambda candidate: -candidate[1])
+
+
+class ClassificationSession:
+    # One walk through the rule graph, driven one answer at a time. feature_order optionally maps
+    # a node index to the order (positions into its required features) its questions are asked in.
+    # After the first "Don't know" (answer(None)) the session keeps the other branches open but
+    # only asks questions along the most likely one, so it takes as many questions as a single
+    # path. It ends with a ranked list of candidates; until then it behaves exactly as with Yes/No only.
+    # path is always a chain of yes/no edges from the root to the current node (to the top
+    # candidate once finished); asked_rules lists the rules questions were asked for, in order.
+    def __init__(self, graph, feature_order=None, statistics=None, max_branches=MAX_BRANCHES) -> None:
+        self.graph = graph
+        self.feature_order = feature_order or {}
+        self.statistics = statistics
+        self.max_branches = max_branches
+        self.node_index = None
+        self.feature_index = 0
+        self.answers = {}
+        self.path = []
+        self.asked_rules = []
+        self.result = None
+        self.started_at = None
+        self.question_times = []
+        self.branches = None
+        self.candidates = None
+        self._parents = {}
+        self._asked_at = None
+
+    @property
+    def node(self):
+        return self.graph.nodes[self.node_index]
+
+    @property
+    def finished(self) -> bool:
+        return self.result is not None
+
+    def start(self) -> None:
+        self.node_index = None
+        self.feature_index = 0
+        self.answers = {}
+        self.path = []
+        self.asked_rules = []
+        self.result = None
+        self.started_at = time.time()
+        self.question_times = []
+        self.branches = None
+        self.candidates = None
+        self._parents = {}
+        self._asked_at = time.perf_counter()
+        if self.graph.nodes:
+            self._enter(self.graph.root)
+        else:
+            self.result = UNKNOWN_CLASSIFICATION
+
+    def asked_positions(self):
+        # The 2-of-3 decision is a majority vote, so any order gives the same outcome
+        return self.feature_order.get(self.node_index) or range(len(self.node.feature_ids))
+
+    def current_feature(self) -> str:
+        return self.graph.features[self.node.feature_ids[self.asked_positions()[self.feature_index]]]
+
+    def question_text(self) -> str:
+        return self.node.questions[self.asked_positions()[self.feature_index]]
+
+    def answer(self, value):
+        # Records the answer to the current question; None means "Don't know". Returns None while
+        # the current rule still needs answers, otherwise the rule's decision after moving on to the
+        # next node. Once branching, it always returns None; check finished and candidates instead.
+        if value is None or self.branches is not None:
+            return self._answer_branching(value)
+
+        node = self.node
+        feature_names = [self.graph.features[node.feature_ids[position]] for position in self.asked_positions()]
+        self._record_asked()
+        self.answers[feature_names[self.feature_index]] = bool(value)
+        now = time.perf_counter()
+        self.question_times.append((feature_names[self.feature_index], now - self._asked_at))
+        self._asked_at = now
+        self.feature_index += 1
+
+        if self.feature_index < 2:
+            return None
+
+        first = self.answers.get(feature_names[0], False)
+        second = self.answers.get(feature_names[1], False) if len(feature_names) > 1 else False
+        third = self.answers[feature_names[2]] if self.feature_index > 2 else None
+        decision = rule_decision(first, second, third)
+        if decision is None:
+            return None
+
+        self._enter(node.yes if decision else node.no)
+        return decision
+
+    def _answer_branching(self, value) -> None:
+        name = self.current_feature()
+        self._record_asked()
+        self.answers[name] = None if value is None else bool(value)
+        now = time.perf_counter()
+        self.question_times.append((name, now - self._asked_at))
+        self._asked_at = now
+
+        if self.branches is None:
+            self.branches = {self.node_index: 1.0}
+        # The branch being asked about moves on with the answers; the others only move as far as
+        # the answers given so far decide them, without questions of their own. The followed branch
+        # is expanded last so that its edges win in _parents.
+        followed = {self.node_index: self.branches.pop(self.node_index)}
+        others = expand_branches(self.graph, self.branches, self.answers, self.statistics, self.max_branches,
+                                 self.feature_order, parents=self._parents)
+        followed = expand_branches(self.graph, followed, self.answers, self.statistics, len(self.graph.nodes),
+                                   self.feature_order, parents=self._parents)
+        self.branches = merge_branches(others, followed)
+
+        open_followed = [node_index for node_index in followed if not self.graph.nodes[node_index].is_terminal]
+        if open_followed:
+            node_index = max(open_followed, key=lambda node_index: (followed[node_index], -node_index))
+            self.branches = cap_branches(self.graph, self.branches, self.max_branches, keep=node_index)
+            position = rule_outcome(self.graph, node_index, self.answers, self.feature_order)[1]
+            self.path = self._path_to(node_index)
+            self.node_index = node_index
+            self.feature_index = list(self.asked_positions()).index(position)
+            return None
+
+        # The followed branch ended in a terminal group; the remaining open branches are
+        # resolved with the answers given, splitting by the statistics where they don't decide
+        self.branches = expand_branches(self.graph, self.branches, self.answers, self.statistics,
+                                        self.max_branches, self.feature_order, final=True, parents=self._parents)
+        self.candidates = rank_candidates(self.graph, self.branches)
+        self.result = self.candidates[0][0]
+        self.node_index = max((node_index for node_index in self.branches
+                               if self.graph.nodes[node_index].group == self.result),
+                              key=lambda node_index: (self.branches[node_index], -node_index))
+        self.path = self._path_to(self.node_index)
+        return None
+
+    def _record_asked(self) -> None:
+        if not self.asked_rules or self.asked_rules[-1] != self.node_index:
+            self.asked_rules.append(self.node_index)
+
+    def _path_to(self, node_index) -> list:
+        # Follows the parent links back to the root; the graph is acyclic, so this ends
+        path = [node_index]
+        while path[-1] in self._parents:
+            path.append(self._parents[path[-1]])
+        path.reverse()
+        return path
+
+    def label(self):
+        return path_label(self.graph, self.path)
+
+    def record(self) -> dict:
+        # Plain-data summary of the session for the session log
+        record = {
+            "started": self.started_at,
+            "answers": dict(self.answers),
+            "path": [self.graph.nodes[node_index].group for node_index in self.path],
+            "asked_rules": [self.graph.nodes[node_index].group for node_index in self.asked_rules],
+            "result": self.result,
+            "question_times": [[feature, round(seconds, 3)] for feature, seconds in self.question_times],
+        }
+        if self.candidates is not None:
+            record["candidates"] = [[group, round(probability, 3)] for group, probability in self.candidates]
+        return record
+
+    def _enter(self, node_index) -> None:
+        if self.node_index is not None:
+            self._parents[node_index] = self.node_index
+        self.node_index = node_index
+        self.feature_index = 0
+        self.path.append(node_index)
+        if self.node.is_terminal:
+            self.result = self.node.group
+
+
+class ClassificationEngine:
+    # GUI-free inference over a compiled RuleGraph. statistics (see prefetch.BranchStatistics)
+    # weighs the branches of rules left undecided by "Don't know" answers.
+    def __init__(self, graph, feature_order=None, statistics=None) -> None:
+        self.graph = graph
+        self.feature_order = feature_order
+        self.statistics = statistics
+        self._vectorized = None
+
+    @classmethod
+    def from_knowledge_data(cls, knowledge_data):
+        return cls(compile_rule_graph(knowledge_data["Knowledge base"], knowledge_data["Rules"]))
+
+    def new_session(self) -> ClassificationSession:
+        return ClassificationSession(self.graph, self.feature_order, self.statistics)
+
+    def candidates(self, answers, max_branches=MAX_BRANCHES) -> list:
+        # Ranked (group, probability) for answers where a feature that is missing or None is unknown
+        if not self.graph.nodes:
+            return [(UNKNOWN_CLASSIFICATION, 1.0)]
+        branches = expand_branches(self.graph, {self.graph.root: 1.0}, answers, self.statistics, max_branches,
+                                   final=True)
+        return rank_candidates(self.graph, branches)
+
+    def classify(self, get_answer):
+        # get_answer(feature_name) -> bool; unanswered features count as "No" like in answer()
+        nodes = self.graph.nodes
+        features = self.graph.features
+        node_index = self.graph.root
+        path = [node_index]
+        for _ in range(len(nodes)):
+            node = nodes[node_index]
+            if node.is_terminal:
+                return node.group, tuple(nodes[step].group for step in path)
+
+            feature_ids = node.feature_ids
+            first = bool(get_answer(features[feature_ids[0]]))
+            second = bool(get_answer(features[feature_ids[1]])) if len(feature_ids) > 1 else False
+            if first == second:
+                decision = first
+            else:
+                decision = len(feature_ids) > 2 and bool(get_answer(features[feature_ids[2]]))
+
+            node_index = node.yes if decision else node.no
+            path.append(node_index)
+
+        raise ValueError(f"Rule graph has a cycle through '{nodes[node_index].group}'")
+
+    def classify_batch(self, answer_records) -> list:
+        # answer_records is either an iterable of feature -> bool dicts or a columnar
+        # mapping of feature -> sequence of bools. Returns (terminal group, path) per record.
+        if not self.graph.nodes:
+            return [(UNKNOWN_CLASSIFICATION, ()) for _ in _records(answer_records)]
+
+        return [self.classify(lambda name: record.get(name, False)) for record in _records(answer_records)]
+
+    def classify_matrix(self, matrix, columns=None):
+        # NumPy evaluation of an N x F boolean matrix; returns terminal group names per row
+        from vectorized import VectorizedRuleGraph
+
+        if self._vectorized is None:
+            self._vectorized = VectorizedRuleGraph(self.graph)
+        return self._vectorized.classify_groups(matrix, columns)
+
+
+def _records(answer_records):
+    if isinstance(answer_records, Mapping):
+        columns = answer_records
+        row_count = max((len(column) for column in columns.values()), default=0)
+        for row in range(row_count):
+            yield _ColumnRow(columns, row)
+    else:
+        yield from answer_records
+
+
+class _ColumnRow:
+    __slots__ = ("columns", "row")
+
+    def __init__(self, columns, row) -> None:
+        self.columns = columns
+        self.row = row
+
+    def get(self, name, default=None):
+        column = self.columns.get(name)
+        if column is None or self.row >= len(column):
+            return default
+        return column[self.row]
@@ -0,0 +1,149 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from kb_compiler import validate_knowledge_update
+from rule_graph import RuleGraph, update_rule_graph
+
+
+IMAGES_DIR = "Images"
+GRAPH_SECTIONS = ("Knowledge base", "Rules")
+
+
+@dataclass(frozen=True)
+class KnowledgeUpdate:
+    data: dict
+    graph: RuleGraph
+    changed_sections: frozenset
+    changed_groups: tuple
+
+
+def file_state(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class KnowledgeWatcher:
+    # Polls the knowledge base file and the image folder for changes by mtime and size
+    def __init__(self, json_path, images_dir=IMAGES_DIR) -> None:
+        self.json_path = json_path
+        self.images_dir = images_dir
+        self._json_state = file_state(json_path)
+        self._images = self._scan_images()
+
+    def _scan_images(self) -> dict:
+        try:
+            with os.scandir(self.images_dir) as entries:
+                return {os.path.join(self.images_dir, entry.name): (entry.stat().st_mtime_ns, entry.stat().st_size)
+                        for entry in entries if entry.is_file()}
+        except OSError:
+            return {}
+
+    def poll(self) -> tuple:
+        # Returns (whether the JSON changed, {changed image path: its previous (mtime, size) or None})
+        json_state = file_state(self.json_path)
+        json_changed = json_state != self._json_state
+        self._json_state = json_state
+
+        images = self._scan_images()
+        changed_images = {path: self._images.get(path) for path in images.keys() | self._images.keys()
+                          if images.get(path) != self._images.get(path)}
+        self._images = images
+        return json_changed, changed_images
+
+
+def load_baseline(json_path, images_dir=IMAGES_DIR) -> tuple:
+    # The watcher takes its snapshot before the file is read, so an edit made meanwhile is still seen
+    watcher = KnowledgeWatcher(json_path, images_dir)
+    with open(json_path, 'r') as file:
+        return watcher, json.load(file)
+
+
+def load_update(json_path, previous_data, previous_graph) -> KnowledgeUpdate:
+    # Parses the edited knowledge base and validates what differs from previous_data; only the
+    # rules that changed (matched by group) are recompiled, every other node of the rule graph
+    # is shared with previous_graph and keeps its index.
+    # Raises ValueError if the file is incomplete or invalid, e.g. while it is still being saved.
+    with open(json_path, 'r') as file:
+        data = json.load(file)
+    if not isinstance(data, dict):
+        raise ValueError("The knowledge base is not a JSON object")
+
+    changed_sections = frozenset(name for name in data.keys() | previous_data.keys()
+                                 if data.get(name) != previous_data.get(name))
+    errors = validate_knowledge_update(data, previous_data, os.path.dirname(json_path) or ".")
+    if errors:
+        raise ValueError(f"{len(errors)} problem(s), first: {errors[0]}")
+
+    graph, changed_groups = previous_graph, ()
+    if changed_sections & set(GRAPH_SECTIONS):
+        graph, changed_groups = update_rule_graph(previous_graph, data["Knowledge base"], data["Rules"],
+                                                  previous_data["Rules"], "Knowledge base" in changed_sections)
+    return KnowledgeUpdate(data, graph, changed_sections, changed_groups)
+
+
+def node_map(old_graph, new_graph) -> dict:
+    # Old node index -> new node index for the groups that still ask the same questions. After
+    # update_rule_graph a group keeps its index, so this is the identity for unchanged rules.
+    mapping = {}
+    for old_index, node in enumerate(old_graph.nodes):
+        new_index = new_graph.index.get(node.group)
+        if new_index is not None and new_graph.feature_names(new_index) == old_graph.feature_names(old_index):
+            mapping[old_index] = new_index
+    return mapping
+
+
+class HotReloader:
+    # Watches the knowledge base and images of a running KnowledgeBaseApp. Stat polling runs on
+    # the Tk thread; parsing, validation and recompilation run on a worker thread and the result
+    # is handed to app.apply_knowledge_update on the Tk thread.
+    def __init__(self, app, json_path="knowledge_base.json", images_dir=IMAGES_DIR, interval=1000) -> None:
+        self.app = app
+        self.json_path = json_path
+        self.interval = interval
+        self.watcher = None
+        self.data = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="hot-reload")
+        self._baseline = self._executor.submit(load_baseline, json_path, images_dir)
+        self._pending = None
+
+    def start(self) -> None:
+        self.app.root.after(self.interval, self._tick)
+
+    def _tick(self) -> None:
+        if self.watcher is None:
+            if self._baseline.done():
+                try:
+                    self.watcher, self.data = self._baseline.result()
+                except (OSError, ValueError) as error:
+                    print(f"Error: Hot reload disabled, could not read '{self.json_path}': {error}")
+                    return
+        elif self._pending is not None:
+            if self._pending.done():
+                self._finish_reload(self._pending)
+                self._pending = None
+        else:
+            json_changed, changed_images = self.watcher.poll()
+            if changed_images:
+                self.app.invalidate_images(changed_images)
+            if json_changed:
+                self._pending = self._executor.submit(load_update, self.json_path, self.data, self.app.graph)
+        self.app.root.after(self.interval, self._tick)
+
+    def _finish_reload(self, future) -> None:
+        try:
+            update = future.result()
+        except (OSError, ValueError) as error:
+            # Kept the current version; the next save is picked up again
+            print(f"Error: Knowledge base not reloaded: {error}")
+            return
+        self.data = update.data
+        if update.changed_sections:
+            self.app.apply_knowledge_update(update)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
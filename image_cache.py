@@ -0,0 +1,127 @@
+import time
+from collections import OrderedDict
+
+from thumbnails import get_thumbnail
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+# Called as decode_observer(source, seconds) after every decode when metrics are enabled
+decode_observer = None
+
+
+def load_image(source, size):
+    # Decodes the pre-sized thumbnail of source (the source itself if the cache is unavailable)
+    from PIL import Image
+
+    start = time.perf_counter()
+    img = Image.open(get_thumbnail(source, size))
+    if img.size != size:
+        img = img.resize(size)
+    img.load()
+    if decode_observer is not None:
+        decode_observer(source, time.perf_counter() - start)
+    return img
+
+
+class _CacheEntry:
+    __slots__ = ("image", "photo", "master")
+
+    def __init__(self, image) -> None:
+        self.image = image
+        self.photo = None
+        self.master = None
+
+    @property
+    def cost(self) -> int:
+        # RGBA bytes of the decoded image, plus the Tk-side copy once a PhotoImage exists
+        width, height = self.image.size
+        return width * height * 4 * (2 if self.photo is not None else 1)
+
+
+class ImageCache:
+    # Process-wide LRU cache of decoded images and their PhotoImages, bounded by a byte budget.
+    # Decoded images outlive the Tk root; PhotoImages are rebuilt (without decoding) when the
+    # root they belonged to has been replaced.
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __contains__(self, key) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def configure(self, max_bytes) -> None:
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def get_photo(self, source, size, master=None, count=True):
+        # count=False for callers that already counted the lookup (see AsyncImageLoader)
+        entry = self._lookup((source, size), count)
+        if entry is None:
+            entry = self._store((source, size), load_image(source, size))
+
+        if entry.photo is None or entry.master is not master:
+            from PIL import ImageTk
+
+            self.size_bytes -= entry.cost
+            entry.photo = ImageTk.PhotoImage(entry.image, master=master)
+            entry.master = master
+            self.size_bytes += entry.cost
+            self._evict(keep=(source, size))
+        return entry.photo
+
+    def put_image(self, source, size, image) -> None:
+        # Stores an image decoded elsewhere (e.g. on a worker thread)
+        if (source, size) not in self._entries:
+            self._store((source, size), image)
+
+    def record_miss(self) -> None:
+        # For a lookup that missed and was handed to a worker thread instead of get_photo
+        self.misses += 1
+
+    def invalidate(self, source) -> None:
+        for key in [key for key in self._entries if key[0] == source]:
+            self.size_bytes -= self._entries.pop(key).cost
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size_bytes = 0
+
+    def _lookup(self, key, count=True):
+        entry = self._entries.get(key)
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+        if count:
+            self.hits += 1
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key, image) -> _CacheEntry:
+        entry = _CacheEntry(image)
+        self._entries[key] = entry
+        self.size_bytes += entry.cost
+        self._evict(keep=key)
+        return entry
+
+    def _evict(self, keep=None) -> None:
+        while self.size_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            if key == keep:
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(key)
+                continue
+            self.size_bytes -= self._entries.pop(key).cost
+
+
+# Lives for the whole process, so it survives restart_program rebuilding the Tk root
+image_cache = ImageCache()
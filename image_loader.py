@@ -0,0 +1,108 @@
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from image_cache import load_image
+
+
+class AsyncImageLoader:
+    # Decodes and resizes images on a worker pool and hands them back to the Tk main loop
+    # through a queue polled with root.after. Tk objects are only ever touched on the main thread.
+    def __init__(self, root, cache, workers=2, poll_interval=20) -> None:
+        self.root = root
+        self.cache = cache
+        self.poll_interval = poll_interval
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-loader")
+        self._results = queue.Queue()
+        self._in_flight = {}
+        # Other background work (see run): future -> callback
+        self._jobs = {}
+        self._after_id = None
+        self.hits = 0
+        self.misses = 0
+
+    def request(self, source, size, callback=None) -> None:
+        # callback(photo) runs on the main thread once the image is ready; right away if cached.
+        # Prefetches (no callback) are left out of the hit and miss counters, here and in the
+        # cache, so the hit rate reflects what the result screen sees.
+        key = (source, size)
+        if key in self.cache:
+            if callback is not None:
+                self.hits += 1
+                callback(self.cache.get_photo(source, size, self.root))
+            return
+
+        if callback is not None:
+            self.misses += 1
+            self.cache.record_miss()
+        pending = self._in_flight.get(key)
+        if pending is None or pending[0].cancelled():
+            pending = self._in_flight[key] = (self._executor.submit(load_image, source, size), [])
+            pending[0].add_done_callback(lambda done, key=key: self._results.put((key, done)))
+        if callback is not None:
+            pending[1].append(callback)
+        self._schedule_poll()
+
+    def run(self, function, *args, callback) -> None:
+        # Runs function(*args) on the worker pool; callback(future) runs on the main thread once
+        # it has returned or raised. Unlike image loads, cancel_all leaves these running.
+        future = self._executor.submit(function, *args)
+        self._jobs[future] = callback
+        future.add_done_callback(lambda done: self._results.put((None, done)))
+        self._schedule_poll()
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._in_flight or self._jobs)
+
+    def cancel_all(self) -> None:
+        # Cancels queued loads and drops every pending callback; images already being
+        # decoded still end up in the cache
+        for future, callbacks in self._in_flight.values():
+            future.cancel()
+            callbacks.clear()
+
+    def shutdown(self) -> None:
+        self.cancel_all()
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule_poll(self) -> None:
+        if self._after_id is None:
+            self._after_id = self.root.after(self.poll_interval, self._poll)
+
+    def _poll(self) -> None:
+        self._after_id = None
+        while True:
+            try:
+                key, future = self._results.get_nowait()
+            except queue.Empty:
+                break
+
+            if key is None:
+                callback = self._jobs.pop(future, None)
+                if callback is not None and not future.cancelled():
+                    callback(future)
+                continue
+
+            pending = self._in_flight.get(key)
+            if pending is None or pending[0] is not future:
+                continue
+            callbacks = self._in_flight.pop(key)[1]
+            if future.cancelled():
+                continue
+            try:
+                image = future.result()
+            except OSError as error:
+                print(f"Error: Could not load image '{key[0]}': {error}")
+                continue
+
+            self.cache.put_image(key[0], key[1], image)
+            if callbacks:
+                photo = self.cache.get_photo(key[0], key[1], self.root, count=False)
+                for callback in callbacks:
+                    callback(photo)
+
+        if self.busy:
+            self._schedule_poll()
@@ -0,0 +1,197 @@
+import functools
+import json
+import math
+import os
+import threading
+import time
+import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
+
+import image_cache as image_cache_module
+
+
+HOT_PATHS = ("answer", "display_next_question", "end_classification", "display_animal_images",
+             "show_classification_tree", "open_dictionary")
+METRICS_FILE = "metrics.json"
+
+
+class Histogram:
+    # Wall-time histogram in milliseconds with power-of-two buckets
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.maximum = 0.0
+        self.buckets = {}
+
+    def add(self, milliseconds) -> None:
+        self.count += 1
+        self.total += milliseconds
+        self.maximum = max(self.maximum, milliseconds)
+        bucket = max(0, math.ceil(math.log2(milliseconds))) if milliseconds > 1 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction) -> float:
+        # Upper bound of the bucket holding the given fraction of samples
+        if not self.count:
+            return 0.0
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= fraction * self.count:
+                return min(float(2 ** bucket), self.maximum)
+        return self.maximum
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.5),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.maximum,
+            "buckets_ms": {f"<={2 ** bucket}": count for bucket, count in sorted(self.buckets.items())},
+        }
+
+
+class Metrics:
+    # Thread-safe collection of histograms; image decodes are also recorded per file
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.image_histograms = {}
+        self.loader = None
+
+    def record(self, name, milliseconds) -> None:
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).add(milliseconds)
+
+    def record_image(self, source, seconds) -> None:
+        milliseconds = seconds * 1000
+        with self._lock:
+            self.histograms.setdefault("image.decode_resize", Histogram()).add(milliseconds)
+            self.image_histograms.setdefault(source, Histogram()).add(milliseconds)
+
+    def snapshot(self) -> dict:
+        cache = image_cache_module.image_cache
+        lookups = cache.hits + cache.misses
+        with self._lock:
+            snapshot = {
+                "time": time.time(),
+                "timings": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+                "image_decode": {source: histogram.summary() for source, histogram in sorted(self.image_histograms.items())},
+                "image_cache": {
+                    "entries": len(cache),
+                    "bytes": cache.size_bytes,
+                    "hit_rate": cache.hits / lookups if lookups else 0.0,
+                },
+            }
+        if self.loader is not None:
+            requests = self.loader.hits + self.loader.misses
+            snapshot["image_loader"] = {"requests": requests,
+                                        "hit_rate": self.loader.hits / requests if requests else 0.0}
+        return snapshot
+
+
+def instrument_app(app, metrics) -> None:
+    # Wraps the hot-path methods of a KnowledgeBaseApp instance; call before its buttons are
+    # created so their commands pick up the wrappers
+    for name in HOT_PATHS:
+        method = getattr(app, name)
+
+        @functools.wraps(method)
+        def timed(*args, method=method, name=name, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                metrics.record(name, (time.perf_counter() - start) * 1000)
+
+        setattr(app, name, timed)
+
+    metrics.loader = app.image_loader
+    image_cache_module.decode_observer = metrics.record_image
+
+
+class StallMonitor:
+    # Schedules a tick every interval and records how late the event loop ran it
+    def __init__(self, root, metrics, interval=100, threshold=50) -> None:
+        self.root = root
+        self.metrics = metrics
+        self.interval = interval
+        self.threshold = threshold
+        self._expected = None
+
+    def start(self) -> None:
+        self._expected = time.perf_counter() + self.interval / 1000
+        self.root.after(self.interval, self._tick)
+
+    def _tick(self) -> None:
+        lateness = (time.perf_counter() - self._expected) * 1000
+        if lateness > self.threshold:
+            self.metrics.record("event_loop.stall", lateness)
+        self.start()
+
+
+class MetricsOverlay:
+    # On-screen metrics panel toggled with F12; also exports the metrics to a file periodically
+    def __init__(self, root, metrics, metrics_file=METRICS_FILE, export_interval=10000, refresh_interval=500) -> None:
+        self.root = root
+        self.metrics = metrics
+        self.metrics_file = metrics_file
+        self.export_interval = export_interval
+        self.refresh_interval = refresh_interval
+        self.visible = False
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics-export")
+        self.label = tk.Label(root, text="", bg="black", fg="#00FF00", font=("Courier", 11),
+                              justify="left", anchor="nw")
+        root.bind("<F12>", self.toggle)
+
+    def start(self) -> None:
+        self.root.after(self.export_interval, self._export)
+
+    def toggle(self, event=None) -> None:
+        self.visible = not self.visible
+        if self.visible:
+            self.label.place(relx=0.01, rely=0.12, anchor="nw")
+            self.label.lift()
+            self._refresh()
+        else:
+            self.label.place_forget()
+
+    def _refresh(self) -> None:
+        if not self.visible:
+            return
+        self.label.config(text=format_snapshot(self.metrics.snapshot()))
+        self.root.after(self.refresh_interval, self._refresh)
+
+    def _export(self) -> None:
+        self._writer.submit(write_snapshot, self.metrics.snapshot(), self.metrics_file)
+        self.root.after(self.export_interval, self._export)
+
+
+def write_snapshot(snapshot, path) -> None:
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(snapshot, file, indent=2)
+    os.replace(temporary, path)
+
+
+def format_snapshot(snapshot) -> str:
+    lines = [f"{'path':28s} {'n':>6s} {'mean':>8s} {'p99':>8s} {'max':>8s}"]
+    for name, summary in snapshot["timings"].items():
+        lines.append(f"{name:28s} {summary['count']:6d} {summary['mean_ms']:8.1f} {summary['p99_ms']:8.1f} {summary['max_ms']:8.1f}")
+    cache = snapshot["image_cache"]
+    lines.append(f"image cache: {cache['entries']} entries, {cache['bytes'] / 1048576:.1f} MB, hit rate {cache['hit_rate']:.0%}")
+    if "image_loader" in snapshot:
+        loader = snapshot["image_loader"]
+        lines.append(f"image loader: {loader['requests']} requests, hit rate {loader['hit_rate']:.0%}")
+    slowest = sorted(snapshot["image_decode"].items(), key=lambda item: item[1]["max_ms"], reverse=True)[:3]
+    for source, summary in slowest:
+        lines.append(f"slowest decode {os.path.basename(source)}: {summary['max_ms']:.1f} ms")
+    return "\n".join(lines)
+
+
+def start_metrics(root, metrics, metrics_file=METRICS_FILE) -> MetricsOverlay:
+    StallMonitor(root, metrics).start()
+    overlay = MetricsOverlay(root, metrics, metrics_file)
+    overlay.start()
+    return overlay
@@ -0,0 +1,428 @@
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping, Sequence
+
+from rule_graph import RuleGraph, RuleNode, compile_rule_graph
+
+
+COMPILED_SUFFIX = ".kbc"
+MAGIC = b"KTPKB\x00\x00\x01"
+FORMAT_VERSION = 2
+
+# magic, version, string count, feature count, node count, rule count, root, section count,
+# then the byte offsets of the string offsets, string data, feature, node, group lookup,
+# feature lookup and section tables
+HEADER = struct.Struct("<8s7I7I")
+FEATURE = struct.Struct("<II")
+# group, feature count, three feature ids, yes, no, end message (-1 when missing)
+NODE = struct.Struct("<IIiiiiii")
+# string id of a name and its node or feature id; sorted by the UTF-8 bytes of the name
+LOOKUP = struct.Struct("<II")
+STRING_SPAN = struct.Struct("<II")
+SECTION = struct.Struct("<III")
+
+SECTIONS = ("Facts", "Instructions", "Dictionary", "Animal media")
+
+_MISSING = object()
+
+
+def compiled_path(json_path) -> str:
+    return os.path.splitext(json_path)[0] + COMPILED_SUFFIX
+
+
+def validate_knowledge_data(knowledge_data, base_dir=".", extra_images=()) -> list:
+    # Returns a list of human readable problems; an empty list means the knowledge base is valid
+    rules = knowledge_data.get("Rules", [])
+    questions = question_names(knowledge_data.get("Knowledge base", []))
+    errors, rule_index = _rule_index_errors(rules)
+    edges = {}
+    for position, rule in enumerate(rules):
+        errors.extend(_rule_errors(position, rule, rule_index, questions, edges))
+    errors.extend(_graph_errors(rules, edges))
+
+    for group in knowledge_data.get("Animal media", []):
+        for name, media in group.items():
+            errors.extend(_media_errors(name, media, base_dir))
+    for image in extra_images:
+        if not os.path.exists(os.path.join(base_dir, image)):
+            errors.append(f"Image '{image}' does not exist")
+
+    return errors
+
+
+def validate_knowledge_update(knowledge_data, previous_data, base_dir=".") -> list:
+    # validate_knowledge_data for an edit of a knowledge base that passed it before. Only the
+    # rules and "Animal media" entries that differ from previous_data (matched by group name)
+    # are checked in detail, along with the rules whose questions or targets went away; the
+    # cycle and reachability checks only run when an edge of the graph changed.
+    rules = knowledge_data.get("Rules", [])
+    errors, rule_index = _rule_index_errors(rules)
+    old_rules = {rule.get("current animal group"): rule for rule in previous_data.get("Rules", [])}
+    changed = [position for position, rule in enumerate(rules)
+               if old_rules.get(rule.get("current animal group")) != rule]
+    removed_groups = old_rules.keys() - rule_index.keys()
+
+    questions = None
+    removed_questions = set()
+    if knowledge_data.get("Knowledge base") != previous_data.get("Knowledge base"):
+        questions = question_names(knowledge_data.get("Knowledge base", []))
+        removed_questions = question_names(previous_data.get("Knowledge base", [])) - questions
+    if removed_groups or removed_questions:
+        changed = sorted(set(changed) | {
+            position for position, rule in enumerate(rules)
+            if {rule.get("new direction"), rule.get("else")} & removed_groups
+            or removed_questions.intersection(rule.get("required features") or ())
+        })
+    if changed and questions is None:
+        questions = question_names(knowledge_data.get("Knowledge base", []))
+    for position in changed:
+        errors.extend(_rule_errors(position, rules[position], rule_index, questions, {}))
+
+    edge_keys = ("current animal group", "required features", "new direction", "else")
+    first_group = rules[0].get("current animal group") if rules else None
+    old_first_group = next(iter(old_rules), None)
+    if removed_groups or first_group != old_first_group or any(tuple(map(rules[position].get, edge_keys))
+                             != tuple(map(old_rules.get(rules[position].get("current animal group"), {}).get, edge_keys))
+                             for position in changed):
+        edges = {}
+        for position, rule in enumerate(rules):
+            if rule.get("required features"):
+                edges[position] = [rule_index[rule[key]] for key in ("new direction", "else")
+                                   if rule.get(key) in rule_index]
+        errors.extend(_graph_errors(rules, edges))
+
+    old_media = {name: media for group in previous_data.get("Animal media", []) for name, media in group.items()}
+    for group in knowledge_data.get("Animal media", []):
+        for name, media in group.items():
+            if old_media.get(name) != media:
+                errors.extend(_media_errors(name, media, base_dir))
+    return errors
+
+
+def question_names(knowledge_base) -> set:
+    return {feature["name"] for group in knowledge_base for feature in group["features"]}
+
+
+def _rule_index_errors(rules) -> tuple:
+    # (errors, group -> position of its rule) for missing and duplicated group names
+    errors = []
+    rule_index = {}
+    for position, rule in enumerate(rules):
+        group = rule.get("current animal group")
+        if group is None:
+            errors.append(f"Rule {position} has no 'current animal group'")
+            continue
+        if group in rule_index:
+            errors.append(f"Rule {position}: '{group}' is already defined by rule {rule_index[group]}")
+            continue
+        rule_index[group] = position
+    return errors, rule_index
+
+
+def _rule_errors(position, rule, rule_index, questions, edges) -> list:
+    # Checks one rule; the positions of its targets are added to edges[position]
+    errors = []
+    group = rule.get("current animal group", f"#{position}")
+    features = rule.get("required features")
+    if not features:
+        if "end classification" not in rule:
+            errors.append(f"Rule '{group}' has neither 'required features' nor 'end classification'")
+        return errors
+
+    if len(features) != 3:
+        errors.append(f"Rule '{group}' needs exactly 3 required features, has {len(features)}")
+    for name in features:
+        if name not in questions:
+            errors.append(f"Rule '{group}': feature '{name}' has no question in 'Knowledge base'")
+
+    edges[position] = []
+    for key in ("new direction", "else"):
+        target = rule.get(key)
+        if target is None:
+            errors.append(f"Rule '{group}' has no '{key}'")
+        elif target not in rule_index:
+            errors.append(f"Rule '{group}': '{key}' target '{target}' does not exist")
+        else:
+            edges[position].append(rule_index[target])
+    return errors
+
+
+def _media_errors(name, media, base_dir) -> list:
+    return [f"Animal media '{name}': image '{animal['File']}' does not exist"
+            for animal in media.get("Images", []) if not os.path.exists(os.path.join(base_dir, animal["File"]))]
+
+
+def _graph_errors(rules, edges) -> list:
+    if not rules:
+        return ["There are no rules"]
+
+    # Iterative depth-first search from the first rule; grey nodes are on the current path
+    errors = []
+    white, grey, black = 0, 1, 2
+    colour = [white] * len(rules)
+    colour[0] = grey
+    stack = [(0, iter(edges.get(0, ())))]
+    while stack:
+        position, children = stack[-1]
+        child = next(children, None)
+        if child is None:
+            colour[position] = black
+            stack.pop()
+        elif colour[child] == grey:
+            errors.append(f"Cycle: rule '{rules[child]['current animal group']}' can be reached from itself")
+        elif colour[child] == white:
+            colour[child] = grey
+            stack.append((child, iter(edges.get(child, ()))))
+
+    for position, state in enumerate(colour):
+        if state == white:
+            errors.append(f"Rule '{rules[position].get('current animal group')}' is unreachable from the first rule")
+    return errors
+
+
+class _StringTable:
+    def __init__(self) -> None:
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, text) -> int:
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.strings)
+            self.strings.append(text)
+        return string_id
+
+
+def write_compiled(knowledge_data, path) -> int:
+    # Writes the binary artifact atomically; returns its size in bytes
+    graph = compile_rule_graph(knowledge_data["Knowledge base"], knowledge_data["Rules"])
+    strings = _StringTable()
+
+    features = b"".join(FEATURE.pack(strings.intern(name), strings.intern(question))
+                        for name, question in zip(graph.features, graph.feature_questions))
+
+    nodes = []
+    for node in graph.nodes:
+        feature_ids = list(node.feature_ids[:3]) + [-1] * (3 - len(node.feature_ids[:3]))
+        message = -1 if node.message is None else strings.intern(node.message)
+        nodes.append(NODE.pack(strings.intern(node.group), len(node.feature_ids[:3]), *feature_ids,
+                               node.yes, node.no, message))
+    nodes = b"".join(nodes)
+
+    def lookup_table(names) -> bytes:
+        entries = sorted((name.encode("utf-8"), strings.intern(name), value) for name, value in names.items())
+        return b"".join(LOOKUP.pack(string_id, value) for _, string_id, value in entries)
+
+    groups = lookup_table(graph.index)
+    feature_names = lookup_table(graph.feature_index)
+
+    blobs = []
+    section_entries = []
+    blob_offset = 0
+    for name in SECTIONS:
+        if name in knowledge_data:
+            blob = json.dumps(knowledge_data[name], ensure_ascii=False).encode("utf-8")
+            section_entries.append(SECTION.pack(strings.intern(name), blob_offset, len(blob)))
+            blobs.append(blob)
+            blob_offset += len(blob)
+
+    encoded = [text.encode("utf-8") for text in strings.strings]
+    string_offsets = [0]
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+
+    offsets_table = struct.pack(f"<{len(string_offsets)}I", *string_offsets)
+    string_data = b"".join(encoded)
+    sections = b"".join(section_entries)
+
+    table_offsets = []
+    position = HEADER.size
+    body = []
+    for table in (offsets_table, string_data, features, nodes, groups, feature_names, sections):
+        # Keep every table 4-byte aligned for the struct readers
+        padding = -position % 4
+        body.append(b"\x00" * padding)
+        position += padding
+        table_offsets.append(position)
+        body.append(table)
+        position += len(table)
+    body.append(b"".join(blobs))
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, len(strings.strings), len(graph.features), len(graph.nodes),
+                         graph.rule_count, graph.root, len(section_entries), *table_offsets)
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as file:
+        file.write(header)
+        file.writelines(body)
+    os.replace(temporary, path)
+    return position + blob_offset
+
+
+class _Strings:
+    # The string table, decoded one string at a time on first use
+    def __init__(self, buffer, offsets_at, data_at, count) -> None:
+        self.buffer = buffer
+        self.offsets_at = offsets_at
+        self.data_at = data_at
+        self.count = count
+        self._decoded = {}
+
+    def raw(self, string_id) -> bytes:
+        start, end = STRING_SPAN.unpack_from(self.buffer, self.offsets_at + 4 * string_id)
+        return self.buffer[self.data_at + start:self.data_at + end]
+
+    def __getitem__(self, string_id) -> str:
+        text = self._decoded.get(string_id)
+        if text is None:
+            text = self._decoded[string_id] = self.raw(string_id).decode("utf-8")
+        return text
+
+
+class _StringColumn(Sequence):
+    # One string field of a fixed-width table, e.g. the feature names of the feature table
+    def __init__(self, strings, table_at, count, row, field) -> None:
+        self.strings = strings
+        self.table_at = table_at
+        self.count = count
+        self.row = row
+        self.field = field
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index) -> str:
+        if not -self.count <= index < self.count:
+            raise IndexError(index)
+        return self.strings[self.row.unpack_from(self.strings.buffer, self.table_at + index % self.count * self.row.size)[self.field]]
+
+
+class _NodeTable(Sequence):
+    # The node table; a RuleNode is built the first time its index is asked for and kept
+    def __init__(self, strings, nodes_at, count, feature_questions) -> None:
+        self.strings = strings
+        self.nodes_at = nodes_at
+        self.count = count
+        self.feature_questions = feature_questions
+        self._nodes = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index) -> RuleNode:
+        node = self._nodes.get(index)
+        if node is not None:
+            return node
+        if not -self.count <= index < self.count:
+            raise IndexError(index)
+        index %= self.count
+        group_id, count, first, second, third, yes, no, message_id = NODE.unpack_from(
+            self.strings.buffer, self.nodes_at + index * NODE.size)
+        feature_ids = (first, second, third)[:count]
+        node = self._nodes[index] = RuleNode(
+            group=self.strings[group_id],
+            feature_ids=feature_ids,
+            questions=tuple(self.feature_questions[feature_id] for feature_id in feature_ids),
+            yes=yes,
+            no=no,
+            message=None if message_id < 0 else self.strings[message_id],
+        )
+        return node
+
+
+class _Lookup(Mapping):
+    # Name -> id by binary search over a table sorted by the names' UTF-8 bytes
+    def __init__(self, strings, table_at, count) -> None:
+        self.strings = strings
+        self.table_at = table_at
+        self.count = count
+
+    def _entry(self, position) -> tuple:
+        return LOOKUP.unpack_from(self.strings.buffer, self.table_at + position * LOOKUP.size)
+
+    def __getitem__(self, name):
+        if not isinstance(name, str):
+            raise KeyError(name)
+        key = name.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            string_id, value = self._entry(middle)
+            found = self.strings.raw(string_id)
+            if found == key:
+                return value
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        raise KeyError(name)
+
+    def __iter__(self):
+        for position in range(self.count):
+            yield self.strings[self._entry(position)[0]]
+
+    def __len__(self) -> int:
+        return self.count
+
+
+class CompiledKnowledgeBase:
+    # Memory-mapped view of a compiled knowledge base. Opening it only reads the header: rule
+    # nodes, feature names, questions and the group and feature lookups are read from the mapping
+    # when first used, behind the same RuleGraph interface as compile_rule_graph returns. The
+    # other sections stay as JSON blobs until they are asked for.
+    def __init__(self, path) -> None:
+        with open(path, "rb") as file:
+            self._buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._buffer) < HEADER.size:
+            raise ValueError(f"{path} is not a compiled knowledge base (version {FORMAT_VERSION})")
+
+        (magic, version, string_count, feature_count, node_count, rule_count, root, section_count,
+         offsets_at, strings_at, features_at, nodes_at, groups_at, feature_names_at,
+         sections_at) = HEADER.unpack_from(self._buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a compiled knowledge base (version {FORMAT_VERSION})")
+        blobs_at = sections_at + section_count * SECTION.size
+        if blobs_at > len(self._buffer):
+            raise ValueError(f"{path} is truncated")
+
+        strings = _Strings(self._buffer, offsets_at, strings_at, string_count)
+        feature_questions = _StringColumn(strings, features_at, feature_count, FEATURE, 1)
+        group_count = (feature_names_at - groups_at) // LOOKUP.size
+        self.graph = RuleGraph(
+            nodes=_NodeTable(strings, nodes_at, node_count, feature_questions),
+            features=_StringColumn(strings, features_at, feature_count, FEATURE, 0),
+            feature_questions=feature_questions,
+            index=_Lookup(strings, groups_at, group_count),
+            feature_index=_Lookup(strings, feature_names_at, feature_count),
+            rule_count=rule_count,
+            root=root,
+            synthetic_nodes=range(rule_count, node_count),
+        )
+
+        self._sections = {}
+        for name_id, offset, length in SECTION.iter_unpack(self._buffer[sections_at:blobs_at]):
+            self._sections[strings[name_id]] = (blobs_at + offset, length)
+        self._decoded = {}
+
+    def section(self, name, default=_MISSING):
+        if name not in self._decoded:
+            if name not in self._sections:
+                if default is _MISSING:
+                    raise KeyError(name)
+                return default
+            offset, length = self._sections[name]
+            self._decoded[name] = json.loads(self._buffer[offset:offset + length].decode("utf-8"))
+        return self._decoded[name]
+
+
+def load_compiled_if_fresh(json_path):
+    # The compiled artifact is used only when it is newer than the JSON it was built from
+    path = compiled_path(json_path)
+    try:
+        if os.path.getmtime(path) <= os.path.getmtime(json_path):
+            return None
+        return CompiledKnowledgeBase(path)
+    except (OSError, ValueError, struct.error):
+        return None
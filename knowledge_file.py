@@ -0,0 +1,97 @@
+import json
+import re
+import threading
+from collections.abc import Sequence
+
+
+WHITESPACE = re.compile(r'\s*')
+_MISSING = object()
+
+
+class KnowledgeFile:
+    # Parses the top-level sections of knowledge_base.json one at a time, in file order, and
+    # only as far as the sections asked for so far. Each value is still decoded by the C parser.
+    # A section can't be reached without parsing the ones before it, so asking for the last
+    # section costs as much as a full json.load; the saving is only for the early sections.
+    # Sections can be asked for from several threads; each one is parsed under a lock, so one
+    # thread can take a section as soon as it is parsed while another parses further.
+    def __init__(self, path) -> None:
+        with open(path, 'r') as file:
+            self._text = file.read()
+        self._decoder = json.JSONDecoder()
+        self._sections = {}
+        self._position = WHITESPACE.match(self._text).end()
+        if self._text[self._position:self._position + 1] != "{":
+            raise ValueError(f"{path}: expected a JSON object at the top level")
+        self._position += 1
+        self._complete = False
+        self._lock = threading.Lock()
+
+    def section(self, name, default=_MISSING):
+        while True:
+            with self._lock:
+                if name in self._sections or self._complete:
+                    break
+                self._parse_next()
+        if name in self._sections:
+            return self._sections[name]
+        if default is _MISSING:
+            raise KeyError(name)
+        return default
+
+    def _skip_whitespace(self) -> None:
+        self._position = WHITESPACE.match(self._text, self._position).end()
+
+    def _parse_next(self) -> None:
+        self._skip_whitespace()
+        if self._text[self._position:self._position + 1] == "}":
+            self._complete = True
+            return
+
+        key, self._position = self._decoder.raw_decode(self._text, self._position)
+        self._skip_whitespace()
+        if self._text[self._position:self._position + 1] != ":":
+            raise ValueError(f"Expected ':' after section name '{key}'")
+        self._position += 1
+        self._skip_whitespace()
+        self._sections[key], self._position = self._decoder.raw_decode(self._text, self._position)
+
+        self._skip_whitespace()
+        separator = self._text[self._position:self._position + 1]
+        if separator == ",":
+            self._position += 1
+        elif separator == "}":
+            self._complete = True
+        else:
+            raise ValueError(f"Expected ',' or '}}' after section '{key}'")
+
+        if self._complete:
+            # Everything is parsed, the raw text is no longer needed
+            self._text = ""
+
+
+class LazySection(Sequence):
+    # List-like stand-in for a section that is only parsed on first use
+    def __init__(self, knowledge_file, name, default=_MISSING) -> None:
+        self.knowledge_file = knowledge_file
+        self.name = name
+        self.default = default
+        self._value = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not None
+
+    def value(self):
+        if self._value is None:
+            self._value = self.knowledge_file.section(self.name, self.default)
+        return self._value
+
+    def __getitem__(self, index):
+        return self.value()[index]
+
+    def __len__(self) -> int:
+        return len(self.value())
+
+    def __iter__(self):
+        return iter(self.value())
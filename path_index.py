@@ -0,0 +1,234 @@
+from dataclasses import dataclass
+from itertools import combinations, product
+
+
+@dataclass(frozen=True)
+class PathStep:
+    node_index: int
+    decision: bool
+    feature_mask: int
+    # Each alternative is a (must_true, must_false) pair of feature bitsets; the step is taken
+    # when the answers satisfy at least one of them
+    alternatives: tuple
+
+
+@dataclass(frozen=True)
+class GraphPath:
+    terminal: int
+    nodes: tuple
+    steps: tuple
+    # Literals every way through this path needs
+    required_true: int
+    required_false: int
+    feature_mask: int
+
+
+def bits(feature_ids) -> int:
+    mask = 0
+    for feature_id in feature_ids:
+        mask |= 1 << feature_id
+    return mask
+
+
+def bit_ids(mask):
+    # The positions of the set bits of mask, lowest first
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def minimize(alternatives) -> tuple:
+    # Drops contradictory and duplicate alternatives and those implied by a smaller one
+    unique = {(must_true, must_false) for must_true, must_false in alternatives if not must_true & must_false}
+    return tuple(sorted(
+        (must_true, must_false) for must_true, must_false in unique
+        if not any((other_true, other_false) != (must_true, must_false)
+                   and other_true & must_true == other_true and other_false & must_false == other_false
+                   for other_true, other_false in unique)
+    ))
+
+
+def step_alternatives(feature_ids, decision) -> tuple:
+    # A rule decides by majority over three answer slots, where a missing slot counts as "No"
+    # (see rule_decision and ClassificationEngine.classify); a decision needs two agreeing slots
+    slots = list(feature_ids[:3]) + [None] * (3 - len(feature_ids[:3]))
+    alternatives = []
+    for pair in combinations(slots, 2):
+        if decision and None in pair:
+            continue
+        literals = bits(feature_id for feature_id in pair if feature_id is not None)
+        alternatives.append((literals, 0) if decision else (0, literals))
+    return minimize(alternatives)
+
+
+class PathIndex:
+    # Every root-to-terminal path of a RuleGraph, enumerated once. For each terminal group,
+    # the index holds the feature constraints that reach it as bitsets over feature ids. It also
+    # maps each feature to the groups whose paths it can affect. Queries are bitset intersections.
+    def __init__(self, graph) -> None:
+        self.graph = graph
+        self.paths = []
+        self.group_paths = {}
+        self.feature_paths = {}
+        # Inverted index for queries, with path sets as bitsets over path ids: the paths of each
+        # group, the paths through each (node index, decision) step with that step's
+        # alternatives, and the steps each feature appears in
+        self.group_path_bits = {}
+        self.step_path_bits = {}
+        self.step_alternatives = {}
+        self.feature_steps = {}
+        if graph.nodes:
+            self._enumerate()
+
+        self.feature_groups = {
+            graph.features[feature_id]: frozenset(graph.nodes[self.paths[path_id].terminal].group
+                                                  for path_id in path_ids)
+            for feature_id, path_ids in self.feature_paths.items()
+        }
+
+    def _enumerate(self) -> None:
+        # Depth-first over (node, decision) edges; paths that would revisit a node or need a
+        # decision no answers can produce are not reachable and are left out
+        stack = [(self.graph.root, (), ())]
+        while stack:
+            node_index, nodes, steps = stack.pop()
+            nodes = nodes + (node_index,)
+            node = self.graph.nodes[node_index]
+            if node.is_terminal:
+                self._add_path(node_index, nodes, steps)
+                continue
+
+            for child, decision in ((node.no, False), (node.yes, True)):
+                alternatives = step_alternatives(node.feature_ids, decision)
+                if alternatives and child not in nodes:
+                    step = PathStep(node_index, decision, bits(node.feature_ids), alternatives)
+                    stack.append((child, nodes, steps + (step,)))
+
+    def _add_path(self, terminal, nodes, steps) -> None:
+        required_true = required_false = feature_mask = 0
+        for step in steps:
+            step_true, step_false = step.alternatives[0]
+            for must_true, must_false in step.alternatives[1:]:
+                step_true &= must_true
+                step_false &= must_false
+            required_true |= step_true
+            required_false |= step_false
+            feature_mask |= step.feature_mask
+        if required_true & required_false:
+            return
+
+        path_id = len(self.paths)
+        path_bit = 1 << path_id
+        group = self.graph.nodes[terminal].group
+        self.paths.append(GraphPath(terminal, nodes, steps, required_true, required_false, feature_mask))
+        self.group_paths.setdefault(group, []).append(path_id)
+        self.group_path_bits[group] = self.group_path_bits.get(group, 0) | path_bit
+        for feature_id in bit_ids(feature_mask):
+            self.feature_paths.setdefault(feature_id, []).append(path_id)
+        for step in steps:
+            key = (step.node_index, step.decision)
+            if key not in self.step_path_bits:
+                self.step_path_bits[key] = 0
+                self.step_alternatives[key] = step.alternatives
+                for feature_id in bit_ids(step.feature_mask):
+                    self.feature_steps.setdefault(feature_id, []).append(key)
+            self.step_path_bits[key] |= path_bit
+
+    def answer_masks(self, answers) -> tuple:
+        # feature name -> bool into (yes bitset, no bitset); unknown features are ignored
+        yes_mask = no_mask = 0
+        for name, value in answers.items():
+            feature_id = self.graph.feature_index.get(name)
+            if feature_id is not None:
+                if value:
+                    yes_mask |= 1 << feature_id
+                else:
+                    no_mask |= 1 << feature_id
+        return yes_mask, no_mask
+
+    def path_consistent(self, path, yes_mask, no_mask) -> bool:
+        if path.required_true & no_mask or path.required_false & yes_mask:
+            return False
+        answered = yes_mask | no_mask
+        if not path.feature_mask & answered:
+            return True
+        for step in path.steps:
+            if step.feature_mask & answered and not any(not must_true & no_mask and not must_false & yes_mask
+                                                        for must_true, must_false in step.alternatives):
+                return False
+        return True
+
+    def consistent_paths(self, yes_mask, no_mask) -> int:
+        # Bitset of the path ids that some completion of the answers still follows. Only the
+        # steps that ask an answered feature are checked, each once however many paths share it;
+        # a step the answers rule out removes every path through it.
+        blocked = 0
+        checked = set()
+        for feature_id in bit_ids(yes_mask | no_mask):
+            for key in self.feature_steps.get(feature_id, ()):
+                if key in checked:
+                    continue
+                checked.add(key)
+                if not any(not must_true & no_mask and not must_false & yes_mask
+                           for must_true, must_false in self.step_alternatives[key]):
+                    blocked |= self.step_path_bits[key]
+        return ((1 << len(self.paths)) - 1) & ~blocked
+
+    def consistent_groups(self, answers) -> list:
+        # Terminal groups that some completion of the partial answers still reaches, in the
+        # order of their first such path
+        consistent = self.consistent_paths(*self.answer_masks(answers))
+        reached = []
+        for group, path_bits in self.group_path_bits.items():
+            path_bits &= consistent
+            if path_bits:
+                reached.append(((path_bits & -path_bits).bit_length(), group))
+        return [group for _, group in sorted(reached)]
+
+    def requirements(self, group) -> list:
+        # The GraphPaths that end in group; usually one, more for shared targets
+        return [self.paths[path_id] for path_id in self.group_paths.get(group, ())]
+
+    def minimal_sets(self, path, limit=None):
+        # Expands a path into its minimal (must_true, must_false) answer sets. There can be up to
+        # 3 ** len(path.steps) of them, so they are generated on demand rather than stored.
+        produced = 0
+        for choice in product(*(step.alternatives for step in path.steps)):
+            must_true = must_false = 0
+            for step_true, step_false in choice:
+                must_true |= step_true
+                must_false |= step_false
+            if must_true & must_false:
+                continue
+            yield must_true, must_false
+            produced += 1
+            if limit is not None and produced >= limit:
+                return
+
+    def feature_names(self, mask) -> list:
+        return [self.graph.features[feature_id] for feature_id in bit_ids(mask)]
+
+    def describe_requirements(self, group) -> str:
+        paths = self.requirements(group)
+        if not paths:
+            return f"'{group}' cannot be reached"
+
+        lines = []
+        for path in paths:
+            lines.append(f"{group} via {' -> '.join(self.graph.nodes[node_index].group for node_index in path.nodes)}")
+            for step in path.steps:
+                names = self.graph.feature_names(step.node_index)
+                answer = "Yes" if step.decision else "No"
+                if len(step.alternatives) == 1:
+                    must_true, must_false = step.alternatives[0]
+                    literals = self.feature_names(must_true | must_false)
+                    condition = f"{', '.join(literals)}: {answer}" if literals else "always"
+                else:
+                    condition = f"at least 2 of {', '.join(names)}: {answer}"
+                lines.append(f"  {self.graph.nodes[step.node_index].group}: {condition}")
+            combinations_count = 1
+            for step in path.steps:
+                combinations_count *= len(step.alternatives)
+            lines.append(f"  up to {combinations_count} minimal answer set(s)")
+        return "\n".join(lines)
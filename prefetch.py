@@ -0,0 +1,78 @@
+import heapq
+
+
+class BranchStatistics:
+    # Observed "new direction" / "else" decisions per rule node
+    def __init__(self) -> None:
+        self.counts = {}
+
+    def record(self, node_index, decision) -> None:
+        counts = self.counts.setdefault(node_index, [0, 0])
+        counts[1 if decision else 0] += 1
+
+    def remap(self, node_map) -> None:
+        # Moves the counts to new node indices after a reload; nodes missing from node_map are dropped
+        self.counts = {node_map[node_index]: counts for node_index, counts in self.counts.items()
+                       if node_index in node_map}
+
+    def probability(self, node_index, decision) -> float:
+        # Laplace-smoothed, so unseen nodes split 50/50 and the ranking falls back to depth
+        no_count, yes_count = self.counts.get(node_index, (0, 0))
+        return ((yes_count if decision else no_count) + 1) / (no_count + yes_count + 2)
+
+
+def reachable_terminals(graph, node_index, statistics=None):
+    # Best-first walk from node_index; yields (terminal node index, probability) with the
+    # most likely terminal first, so callers can stop as soon as their budget is spent
+    statistics = statistics or BranchStatistics()
+    heap = [(-1.0, 0, node_index)]
+    visited = set()
+
+    while heap:
+        negative_probability, depth, current = heapq.heappop(heap)
+        if current in visited:
+            continue
+        visited.add(current)
+
+        node = graph.nodes[current]
+        if node.is_terminal:
+            yield current, -negative_probability
+            continue
+
+        for child, decision in ((node.yes, True), (node.no, False)):
+            if child not in visited:
+                probability = -negative_probability * statistics.probability(current, decision)
+                heapq.heappush(heap, (-probability, depth + 1, child))
+
+
+class Prefetcher:
+    # Warms the image cache for the terminal groups reachable from the current rule
+    def __init__(self, graph, loader, media_for_group, size, budget=6) -> None:
+        self.graph = graph
+        self.loader = loader
+        self.media_for_group = media_for_group
+        self.size = size
+        self.budget = budget
+
+    def prefetch_from(self, node_index, statistics=None, graph=None) -> list:
+        # graph defaults to the prefetcher's own; a session still running on a replaced graph passes its own
+        graph = graph if graph is not None else self.graph
+        files = []
+        for terminal, _ in reachable_terminals(graph, node_index, statistics):
+            media = self.media_for_group(graph.nodes[terminal].group)
+            if media is None:
+                continue
+            for animal in media["Images"]:
+                if len(files) >= self.budget:
+                    break
+                files.append(animal["File"])
+            if len(files) >= self.budget:
+                break
+
+        for source in files:
+            self.loader.request(source, self.size)
+        return files
+
+
+# Shared by all sessions of the process so the ranking improves as visitors answer
+branch_statistics = BranchStatistics()
@@ -0,0 +1,122 @@
+from itertools import combinations
+
+
+# Pseudo-count given to the independence estimate when a pair of features was rarely seen together
+PRIOR_WEIGHT = 2.0
+
+
+class AnswerStatistics:
+    # Answer statistics gathered from logged sessions: how often each feature is answered "Yes",
+    # how often two features get the same answer, how often each rule is reached and how many
+    # questions completed sessions took
+    def __init__(self, graph) -> None:
+        self.graph = graph
+        self.feature_counts = {}
+        self.pair_counts = {}
+        self.node_visits = {}
+        self.sessions = 0
+        self.observed = {}
+
+    @classmethod
+    def from_sessions(cls, graph, sessions):
+        statistics = cls(graph)
+        for record in sessions:
+            statistics.add(record)
+        return statistics
+
+    def add(self, record) -> None:
+        # "Don't know" answers (None) say nothing about the features
+        answers = {name: value for name, value in record.get("answers", {}).items() if value is not None}
+        for name, value in answers.items():
+            counts = self.feature_counts.setdefault(name, [0, 0])
+            counts[0] += 1
+            counts[1] += bool(value)
+        for first, second in combinations(sorted(answers), 2):
+            counts = self.pair_counts.setdefault((first, second), [0, 0])
+            counts[0] += 1
+            counts[1] += answers[first] == answers[second]
+
+        if not record.get("completed", record.get("result") is not None):
+            return
+        self.sessions += 1
+        for group in set(record.get("path", ())):
+            node_index = self.graph.index.get(group)
+            if node_index is not None:
+                self.node_visits[node_index] = self.node_visits.get(node_index, 0) + 1
+        totals = self.observed.setdefault(record.get("question_order", "file"), [0, 0])
+        totals[0] += 1
+        totals[1] += len(record.get("answers", {}))
+
+    def yes_probability(self, name) -> float:
+        total, yes = self.feature_counts.get(name, (0, 0))
+        return (yes + 1) / (total + 2)
+
+    def agreement(self, first, second) -> float:
+        # Probability that both features get the same answer, shrunk towards the value expected
+        # if they were independent
+        first_yes = self.yes_probability(first)
+        second_yes = self.yes_probability(second)
+        prior = first_yes * second_yes + (1 - first_yes) * (1 - second_yes)
+        total, agreed = self.pair_counts.get(tuple(sorted((first, second))), (0, 0))
+        return (agreed + PRIOR_WEIGHT * prior) / (total + PRIOR_WEIGHT)
+
+    def reach_probability(self, node_index) -> float:
+        if not self.sessions:
+            return 0.0
+        return self.node_visits.get(node_index, 0) / self.sessions
+
+    def best_order(self, node_index) -> tuple:
+        # Ask first the two features most likely to agree, since the third question is only
+        # needed when the first two disagree
+        names = self.graph.feature_names(node_index)
+        if len(names) != 3:
+            return tuple(range(len(names)))
+        first, second = max(combinations(range(3), 2),
+                            key=lambda pair: (self.agreement(names[pair[0]], names[pair[1]]), -pair[0], -pair[1]))
+        return (first, second, 3 - first - second)
+
+    def feature_order(self) -> dict:
+        order = {}
+        for node_index, node in enumerate(self.graph.nodes):
+            if not node.is_terminal:
+                positions = self.best_order(node_index)
+                if positions != tuple(range(len(node.feature_ids))):
+                    order[node_index] = positions
+        return order
+
+    def expected_questions(self, feature_order=None) -> float:
+        # Expected questions per classification: per rule, two questions plus the chance that
+        # the first two disagree, weighted by how often the rule is reached
+        feature_order = feature_order or {}
+        expected = 0.0
+        for node_index, node in enumerate(self.graph.nodes):
+            if node.is_terminal:
+                continue
+            names = self.graph.feature_names(node_index)
+            if len(names) < 3:
+                questions = len(names)
+            else:
+                positions = feature_order.get(node_index, (0, 1, 2))
+                questions = 3 - self.agreement(names[positions[0]], names[positions[1]])
+            expected += self.reach_probability(node_index) * questions
+        return expected
+
+    def observed_questions(self, question_order) -> tuple:
+        # (sessions, mean questions per completed classification) for "file" or "adaptive" order
+        sessions, questions = self.observed.get(question_order, (0, 0))
+        return sessions, (questions / sessions if sessions else 0.0)
+
+
+def question_report(statistics) -> str:
+    adaptive_order = statistics.feature_order()
+    lines = [
+        f"Completed sessions analysed: {statistics.sessions}",
+        f"Rules reordered by adaptive mode: {len(adaptive_order)}",
+        f"Expected questions per classification, file order: {statistics.expected_questions():.2f}",
+        f"Expected questions per classification, adaptive order: {statistics.expected_questions(adaptive_order):.2f}",
+    ]
+    for question_order in ("file", "adaptive"):
+        sessions, mean = statistics.observed_questions(question_order)
+        lines.append(f"Observed questions per classification, {question_order} order: "
+                     + (f"{mean:.2f} over {sessions} sessions" if sessions else "no sessions yet"))
+    return "\n".join(lines)
@@ -0,0 +1,218 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+
+
+NO_QUESTION = "No question available."
+UNKNOWN_CLASSIFICATION = "Unknown classification"
+
+
+@dataclass(frozen=True)
+class RuleNode:
+    group: str
+    feature_ids: tuple
+    questions: tuple
+    yes: int = -1
+    no: int = -1
+    message: str = None
+
+    @property
+    def is_terminal(self) -> bool:
+        # Rules without required features end the classification (or dangle)
+        return not self.feature_ids
+
+
+@dataclass(frozen=True)
+class RuleGraph:
+    nodes: tuple
+    features: tuple
+    feature_questions: tuple
+    index: dict
+    feature_index: dict
+    rule_count: int
+    root: int = 0
+    # Indices of the synthetic terminals appended for targets that have no rule of their own
+    synthetic_nodes: frozenset = frozenset()
+
+    def node_for(self, group):
+        node_index = self.index.get(group)
+        return None if node_index is None else self.nodes[node_index]
+
+    def question_for(self, feature_name) -> str:
+        feature_id = self.feature_index.get(feature_name)
+        return NO_QUESTION if feature_id is None else self.feature_questions[feature_id]
+
+    def is_rule(self, node_index) -> bool:
+        # False for the synthetic terminals of targets that have no rule of their own
+        return node_index not in self.synthetic_nodes
+
+    def feature_names(self, node_index) -> tuple:
+        return tuple(self.features[feature_id] for feature_id in self.nodes[node_index].feature_ids)
+
+
+def build_question_map(knowledge_base) -> dict:
+    # First question text wins, just like the old nested scan did
+    questions = {}
+    for group in knowledge_base:
+        for feature in group["features"]:
+            questions.setdefault(feature["name"], feature.get("question", NO_QUESTION))
+    return questions
+
+
+def compile_rule_graph(knowledge_base, rules) -> RuleGraph:
+    # Turns the "Knowledge base" and "Rules" sections into an integer-indexed graph.
+    # Node i is rule i; targets that have no rule get a synthetic terminal node appended
+    # after the rules, so every edge of the graph points at a real node.
+    questions = build_question_map(knowledge_base)
+    features = list(questions)
+    feature_index = {name: feature_id for feature_id, name in enumerate(features)}
+    for rule in rules:
+        for name in rule.get("required features", ()):
+            if name not in feature_index:
+                feature_index[name] = len(features)
+                features.append(name)
+
+    rule_index = {}
+    for position, rule in enumerate(rules):
+        rule_index.setdefault(rule["current animal group"], position)
+
+    index = dict(rule_index)
+    extra_groups = []
+
+    def resolve(group, missing_group) -> int:
+        if group in rule_index:
+            return rule_index[group]
+        # The Tk app ended on the "new direction" group itself but on "Unknown classification" for "else"
+        group = missing_group if missing_group is not None else group
+        if group not in index:
+            index[group] = len(rules) + len(extra_groups)
+            extra_groups.append(group)
+        return index[group]
+
+    nodes = []
+    for rule in rules:
+        feature_names = rule.get("required features", ())
+        yes = no = -1
+        if feature_names:
+            yes = resolve(rule["new direction"], None)
+            no = resolve(rule["else"], UNKNOWN_CLASSIFICATION)
+        nodes.append(RuleNode(
+            group=rule["current animal group"],
+            feature_ids=tuple(feature_index[name] for name in feature_names),
+            questions=tuple(questions.get(name, NO_QUESTION) for name in feature_names),
+            yes=yes,
+            no=no,
+            message=rule.get("end classification"),
+        ))
+
+    for group in extra_groups:
+        nodes.append(RuleNode(group=group, feature_ids=(), questions=()))
+
+    return RuleGraph(
+        nodes=tuple(nodes),
+        features=tuple(features),
+        feature_questions=tuple(questions.get(name, NO_QUESTION) for name in features),
+        index=MappingProxyType(index),
+        feature_index=MappingProxyType(feature_index),
+        rule_count=len(rules),
+        synthetic_nodes=frozenset(range(len(rules), len(nodes))),
+    )
+
+
+def update_rule_graph(previous, knowledge_base, rules, previous_rules, knowledge_base_changed=True) -> tuple:
+    # Recompiles an edited knowledge base against the graph of its previous version. Rules are
+    # matched to previous_rules by "current animal group" and only the nodes of rules that
+    # changed, whose questions changed, or whose targets gained or lost a rule are rebuilt; every
+    # other node is shared with previous. Node indices are keyed on the group, not on the rule's
+    # position: a group keeps its index, new groups are appended, and the nodes of removed groups
+    # stay behind unreachable and out of the index. Returns (graph, groups whose node changed).
+    features = list(previous.features)
+    feature_index = dict(previous.feature_index)
+    feature_questions = list(previous.feature_questions)
+    changed_features = set()
+    if knowledge_base_changed:
+        questions = build_question_map(knowledge_base)
+        for name in questions:
+            if name not in feature_index:
+                feature_index[name] = len(features)
+                features.append(name)
+                feature_questions.append(NO_QUESTION)
+        for feature_id, name in enumerate(features):
+            question = questions.get(name, NO_QUESTION)
+            if question != feature_questions[feature_id]:
+                feature_questions[feature_id] = question
+                changed_features.add(feature_id)
+
+    new_rules = {}
+    for rule in rules:
+        new_rules.setdefault(rule["current animal group"], rule)
+    old_rules = {}
+    for rule in previous_rules:
+        old_rules.setdefault(rule["current animal group"], rule)
+
+    # Targets that gained or lost a rule of their own; their parents point at a different node now
+    retargeted = old_rules.keys() ^ new_rules.keys()
+    rebuild = {group for group, rule in new_rules.items() if old_rules.get(group) != rule}
+    if changed_features:
+        rebuild.update(group for group in new_rules
+                       if group in previous.index and changed_features.intersection(previous.node_for(group).feature_ids))
+    if retargeted:
+        rebuild.update(group for group, rule in new_rules.items()
+                       if rule.get("required features") and (rule["new direction"] in retargeted or rule["else"] in retargeted))
+
+    nodes = list(previous.nodes)
+    index = dict(previous.index)
+    synthetic_nodes = set(previous.synthetic_nodes)
+    for group in old_rules.keys() - new_rules.keys():
+        del index[group]
+    for group in new_rules:
+        if group not in index:
+            index[group] = len(nodes)
+            nodes.append(None)
+        synthetic_nodes.discard(index[group])
+
+    def resolve(group, missing_group) -> int:
+        if group in new_rules:
+            return index[group]
+        group = missing_group if missing_group is not None else group
+        if group not in index:
+            index[group] = len(nodes)
+            nodes.append(RuleNode(group=group, feature_ids=(), questions=()))
+            synthetic_nodes.add(index[group])
+        return index[group]
+
+    changed_groups = set(old_rules.keys() - new_rules.keys())
+    for group in sorted(rebuild):
+        rule = new_rules[group]
+        feature_names = rule.get("required features", ())
+        for name in feature_names:
+            if name not in feature_index:
+                feature_index[name] = len(features)
+                features.append(name)
+                feature_questions.append(NO_QUESTION)
+        yes = no = -1
+        if feature_names:
+            yes = resolve(rule["new direction"], None)
+            no = resolve(rule["else"], UNKNOWN_CLASSIFICATION)
+        node = RuleNode(
+            group=group,
+            feature_ids=tuple(feature_index[name] for name in feature_names),
+            questions=tuple(feature_questions[feature_index[name]] for name in feature_names),
+            yes=yes,
+            no=no,
+            message=rule.get("end classification"),
+        )
+        if node != nodes[index[group]]:
+            nodes[index[group]] = node
+            changed_groups.add(group)
+
+    graph = RuleGraph(
+        nodes=tuple(nodes),
+        features=tuple(features),
+        feature_questions=tuple(feature_questions),
+        index=MappingProxyType(index),
+        feature_index=MappingProxyType(feature_index),
+        rule_count=len(rules),
+        root=index[rules[0]["current animal group"]] if rules else 0,
+        synthetic_nodes=frozenset(synthetic_nodes),
+    )
+    return graph, tuple(sorted(changed_groups))
@@ -0,0 +1,370 @@
+import asyncio
+import json
+import random
+import secrets
+import sys
+import time
+
+from engine import ClassificationEngine
+from prefetch import BranchStatistics
+from rule_graph import compile_rule_graph
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+SESSION_TTL = 15 * 60
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 500: "Internal Server Error"}
+
+
+class ServiceSession:
+    __slots__ = ("session", "label", "last_used")
+
+    def __init__(self, session) -> None:
+        self.session = session
+        self.label = None
+        self.last_used = time.monotonic()
+
+
+class ClassificationService:
+    # Hosts many classification sessions over one shared rule graph. A session is only a cursor
+    # into the graph plus its answers, so sessions are cheap and nothing is loaded per client.
+    #
+    #   POST   /sessions               start a session, returns its first question
+    #   POST   /sessions/<id>/answer   {"answer": true|false|null}, same semantics as answer()
+    #   GET    /sessions/<id>/result   the end_classification message and example animals
+    #   DELETE /sessions/<id>          end a session early
+    #
+    # Sessions idle for longer than ttl seconds expire.
+    def __init__(self, engine, animal_media=(), session_logger=None, ttl=SESSION_TTL) -> None:
+        self.engine = engine
+        self.graph = engine.graph
+        self.animal_media = animal_media
+        self.session_logger = session_logger
+        self.ttl = ttl
+        self.sessions = {}
+        self._media_index = None
+
+    @classmethod
+    def from_knowledge_file(cls, path, session_logger=None, ttl=SESSION_TTL):
+        with open(path, 'r') as file:
+            knowledge_data = json.load(file)
+        # The branch statistics are shared by all sessions, so "Don't know" branches are weighted
+        # by the answers seen so far
+        engine = ClassificationEngine(compile_rule_graph(knowledge_data["Knowledge base"], knowledge_data["Rules"]),
+                                      statistics=BranchStatistics())
+        return cls(engine, knowledge_data.get("Animal media", []), session_logger, ttl)
+
+    def start_session(self) -> dict:
+        session_id = secrets.token_urlsafe(12)
+        entry = self.sessions[session_id] = ServiceSession(self.engine.new_session())
+        entry.session.start()
+        return dict(self._state(entry), session=session_id)
+
+    def answer(self, session_id, value) -> dict:
+        entry = self._get(session_id)
+        session = entry.session
+        if session.finished:
+            raise ServiceError(409, "Session already finished")
+
+        node_index = session.node_index
+        decision = session.answer(value)
+        if decision is not None and self.engine.statistics is not None:
+            self.engine.statistics.record(node_index, decision)
+        # Same label as KnowledgeBaseApp.answer shows
+        entry.label = session.label()
+        if session.finished:
+            self._log(session)
+        return dict(self._state(entry), decision=decision)
+
+    def result(self, session_id) -> dict:
+        session = self._get(session_id).session
+        if not session.finished:
+            raise ServiceError(409, "Session not finished")
+
+        result = {"result": session.result, "path": [self.graph.nodes[step].group for step in session.path],
+                  "asked_rules": [self.graph.nodes[step].group for step in session.asked_rules],
+                  "candidates": [[session.result, 1.0]] if session.candidates is None else session.candidates,
+                  "message": None, "secondary_message": None, "group_name": None, "examples": []}
+        node = self.graph.node_for(session.result)
+        if node is None or node.message is None:
+            return result
+
+        lines = node.message.split("\n")
+        group_name = " ".join(session.result.split(" ")[1:])
+        media = self.media_for_group(session.result)
+        result.update(message=lines[0], secondary_message=lines[1] if len(lines) > 1 else "",
+                      group_name=group_name,
+                      examples=[{"name": animal["Name"], "file": animal["File"], "fact": animal["Fact"]}
+                                for animal in (media or {}).get("Images", [])])
+        return result
+
+    def end_session(self, session_id) -> dict:
+        entry = self._get(session_id)
+        del self.sessions[session_id]
+        # A finished session was already logged by answer()
+        if not entry.session.finished:
+            self._log(entry.session, completed=False)
+        return {"session": session_id, "ended": True}
+
+    def media_for_group(self, classification_group):
+        if self._media_index is None:
+            self._media_index = {}
+            for group in self.animal_media:
+                for name, media in group.items():
+                    self._media_index.setdefault(name, media)
+        return self._media_index.get(" ".join(classification_group.split(" ")[1:]))
+
+    def expire_sessions(self, now=None) -> int:
+        now = time.monotonic() if now is None else now
+        expired = [session_id for session_id, entry in self.sessions.items() if now - entry.last_used > self.ttl]
+        for session_id in expired:
+            entry = self.sessions.pop(session_id)
+            if not entry.session.finished:
+                self._log(entry.session, completed=False)
+        return len(expired)
+
+    def _get(self, session_id) -> ServiceSession:
+        entry = self.sessions.get(session_id)
+        if entry is None:
+            raise ServiceError(404, "Unknown or expired session")
+        entry.last_used = time.monotonic()
+        return entry
+
+    def _state(self, entry) -> dict:
+        session = entry.session
+        state = {"finished": session.finished, "label": entry.label}
+        if session.finished:
+            state["result"] = session.result
+        else:
+            state.update(group=session.node.group, feature=session.current_feature(),
+                         question=session.question_text())
+        return state
+
+    def _log(self, session, completed=True) -> None:
+        # Same records as KnowledgeBaseApp.log_session, so question-stats can use them too
+        if self.session_logger is not None:
+            record = session.record()
+            record["completed"] = completed
+            record["question_order"] = "adaptive" if self.engine.feature_order else "file"
+            self.session_logger.log(record)
+
+    def dispatch(self, method, target, body) -> tuple:
+        # Routes one request; returns (status, JSON-serialisable payload)
+        parts = target.split("?", 1)[0].strip("/").split("/")
+        try:
+            if parts[0] != "sessions" or len(parts) > 3:
+                raise ServiceError(404, "Not found")
+            if len(parts) == 1:
+                if method != "POST":
+                    raise ServiceError(405, "Use POST /sessions")
+                return 201, self.start_session()
+            if len(parts) == 2:
+                if method != "DELETE":
+                    raise ServiceError(405, "Use DELETE /sessions/<id>")
+                return 200, self.end_session(parts[1])
+            if parts[2] == "answer":
+                if method != "POST":
+                    raise ServiceError(405, "Use POST /sessions/<id>/answer")
+                return 200, self.answer(parts[1], parse_answer(body))
+            if parts[2] == "result":
+                if method != "GET":
+                    raise ServiceError(405, "Use GET /sessions/<id>/result")
+                return 200, self.result(parts[1])
+            raise ServiceError(404, "Not found")
+        except ServiceError as error:
+            return error.status, {"error": error.message}
+
+    async def handle_connection(self, reader, writer) -> None:
+        # Minimal HTTP/1.1 with keep-alive; every body is JSON
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                    length = int(headers.get("content-length", 0))
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    status, payload, keep_alive = 400, {"error": "Malformed request"}, False
+                else:
+                    body = await reader.readexactly(length) if length else b""
+                    keep_alive = headers.get("connection", "").lower() != "close"
+                    try:
+                        status, payload = self.dispatch(method, target, body)
+                    except Exception as error:
+                        # A bug in one request must not drop the connection without an answer
+                        print(f"Error: {method} {target} failed: {error!r}", file=sys.stderr)
+                        status, payload, keep_alive = 500, {"error": "Internal error"}, False
+
+                data = json.dumps(payload).encode("utf-8")
+                head = f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n" \
+                       f"Content-Length: {len(data)}\r\n"
+                if not keep_alive:
+                    head += "Connection: close\r\n"
+                writer.write(head.encode("latin-1") + b"\r\n" + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def expire_periodically(self, interval=30) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            self.expire_sessions()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None) -> None:
+        if unix_socket:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_socket)
+            address = unix_socket
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            address = "http://{}:{}".format(*server.sockets[0].getsockname()[:2])
+        print(f"Serving {len(self.graph.nodes)} rule graph nodes on {address}", file=sys.stderr)
+        expiry = asyncio.create_task(self.expire_periodically(min(30, self.ttl)))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            expiry.cancel()
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def parse_answer(body):
+    # true/false, "Yes"/"No", or null/"Don't know" (returned as None)
+    try:
+        request = json.loads(body or b"{}")
+        value = request["answer"]
+    except (ValueError, TypeError, KeyError):
+        raise ServiceError(400, "Body must be a JSON object with an 'answer'")
+    if isinstance(value, str):
+        value = {"yes": True, "no": False, "don't know": None}.get(value.strip().lower(), value)
+    if value is not None and not isinstance(value, bool):
+        raise ServiceError(400, "'answer' must be true/false/null or \"Yes\"/\"No\"/\"Don't know\"")
+    return value
+
+
+def run_service(knowledge_base_path, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, session_logger=None,
+                ttl=SESSION_TTL) -> None:
+    service = ClassificationService.from_knowledge_file(knowledge_base_path, session_logger, ttl)
+    try:
+        asyncio.run(service.serve(host, port, unix_socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if session_logger is not None:
+            session_logger.close()
+
+
+class ServiceClient:
+    # One keep-alive connection to a ClassificationService
+    def __init__(self, reader, writer) -> None:
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None):
+        if unix_socket:
+            return cls(*await asyncio.open_unix_connection(unix_socket))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, method, path, payload=None) -> tuple:
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.writer.wait_closed()
+
+
+async def _load_test_worker(address, deadline, sessions_left, answer_latencies, seed) -> int:
+    rng = random.Random(seed)
+    client = await ServiceClient.connect(*address)
+    completed = 0
+    try:
+        while time.perf_counter() < deadline and sessions_left[0] > 0:
+            sessions_left[0] -= 1
+            status, state = await client.request("POST", "/sessions")
+            session_id = state["session"]
+            while not state["finished"]:
+                start = time.perf_counter()
+                status, state = await client.request("POST", f"/sessions/{session_id}/answer",
+                                                     {"answer": rng.random() < 0.5})
+                answer_latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    raise RuntimeError(f"Answer failed with {status}: {state}")
+            await client.request("GET", f"/sessions/{session_id}/result")
+            completed += 1
+    finally:
+        await client.close()
+    return completed
+
+
+async def load_test(host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, clients=100, sessions=10000,
+                    duration=30.0) -> dict:
+    # Runs `clients` concurrent connections, each classifying sessions with random answers,
+    # until `sessions` sessions were started or `duration` seconds have passed
+    address = (host, port, unix_socket)
+    answer_latencies = []
+    sessions_left = [sessions]
+    start = time.perf_counter()
+    completed = await asyncio.gather(*(
+        _load_test_worker(address, start + duration, sessions_left, answer_latencies, seed)
+        for seed in range(clients)
+    ))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(answer_latencies)
+
+    def percentile(fraction):
+        return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000 if latencies else 0.0
+
+    return {
+        "clients": clients,
+        "sessions": sum(completed),
+        "answers": len(latencies),
+        "seconds": elapsed,
+        "sessions_per_second": sum(completed) / elapsed if elapsed else 0.0,
+        "answer_p50_ms": percentile(0.5),
+        "answer_p99_ms": percentile(0.99),
+    }
+
+
+def run_load_test(host=DEFAULT_HOST, port=DEFAULT_PORT, unix_socket=None, clients=100, sessions=10000,
+                  duration=30.0) -> None:
+    report = asyncio.run(load_test(host, port, unix_socket, clients, sessions, duration))
+    print(f"{report['sessions']} sessions ({report['answers']} answers) from {report['clients']} clients "
+          f"in {report['seconds']:.1f} s: {report['sessions_per_second']:.0f} sessions/s, "
+          f"answer latency p50 {report['answer_p50_ms']:.2f} ms, p99 {report['answer_p99_ms']:.2f} ms")
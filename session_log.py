@@ -0,0 +1,105 @@
+import glob
+import json
+import os
+import queue
+import threading
+
+
+SESSION_LOG_DIR = "session_logs"
+SEGMENT_PATTERN = "sessions-{:06d}.jsonl"
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+
+_CLOSE = object()
+
+
+class SessionLogger:
+    # Append-only JSONL session log. log() only enqueues; a background thread serialises and
+    # writes records in batches and rolls over to a new segment file once one reaches its size limit.
+    def __init__(self, directory=SESSION_LOG_DIR, max_segment_bytes=DEFAULT_SEGMENT_BYTES,
+                 batch_size=64, flush_interval=2.0) -> None:
+        self.directory = directory
+        self.max_segment_bytes = max_segment_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._segment = None
+        self._tail_checked = False
+        self._thread = threading.Thread(target=self._run, name="session-log", daemon=True)
+        self._thread.start()
+
+    def log(self, record) -> None:
+        self._queue.put(record)
+
+    def close(self, timeout=5.0) -> None:
+        # Flushes everything logged so far and stops the writer thread
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        batch = []
+        closing = False
+        while not closing:
+            try:
+                record = self._queue.get(timeout=self.flush_interval if batch else None)
+            except queue.Empty:
+                record = None
+
+            if record is _CLOSE:
+                closing = True
+            elif record is not None:
+                batch.append(record)
+                if len(batch) < self.batch_size:
+                    continue
+
+            if batch:
+                try:
+                    self._write(batch)
+                except OSError as error:
+                    print(f"Error: Could not write session log: {error}")
+                batch = []
+
+    def _write(self, batch) -> None:
+        data = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in batch).encode("utf-8")
+        path = self._segment_path(len(data))
+        if not self._tail_checked:
+            # A crash mid-write can leave the last line without its newline; start on a fresh line
+            self._tail_checked = True
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                with open(path, "rb") as file:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b"\n":
+                        data = b"\n" + data
+        with open(path, "ab") as file:
+            file.write(data)
+
+    def _segment_path(self, incoming_bytes) -> str:
+        if self._segment is None:
+            os.makedirs(self.directory, exist_ok=True)
+            segments = segment_paths(self.directory)
+            self._segment = int(os.path.basename(segments[-1])[9:15]) if segments else 1
+
+        path = os.path.join(self.directory, SEGMENT_PATTERN.format(self._segment))
+        if os.path.exists(path) and os.path.getsize(path) > 0 \
+                and os.path.getsize(path) + incoming_bytes > self.max_segment_bytes:
+            self._segment += 1
+            path = os.path.join(self.directory, SEGMENT_PATTERN.format(self._segment))
+        return path
+
+
+def segment_paths(directory=SESSION_LOG_DIR) -> list:
+    return sorted(glob.glob(os.path.join(directory, "sessions-[0-9][0-9][0-9][0-9][0-9][0-9].jsonl")))
+
+
+def read_sessions(directory=SESSION_LOG_DIR):
+    # Yields every logged session, oldest first. Lines that don't parse, such as one cut short
+    # by a crash mid-write, are skipped with a warning.
+    for path in segment_paths(directory):
+        with open(path, "r", encoding="utf-8", errors="replace") as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    print(f"Error: Skipping unreadable session log line {path}:{line_number}")
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+
+THUMBNAIL_DIR = ".thumbnails"
+ANIMAL_IMAGE_SIZE = (200, 200)
+TREE_IMAGE_PATH = "Images/animal tree.png"
+
+
+def thumbnail_path(source, size, cache_dir=THUMBNAIL_DIR, mtime=None) -> str:
+    # Cache key: absolute source path, its mtime and the target size
+    mtime = os.stat(source).st_mtime_ns if mtime is None else mtime
+    key = f"{os.path.abspath(source)}|{mtime}|{size[0]}x{size[1]}"
+    return os.path.join(cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".png")
+
+
+def make_thumbnail(source, size, cache_dir=THUMBNAIL_DIR) -> tuple:
+    # Returns (thumbnail path, whether it had to be generated)
+    target = thumbnail_path(source, size, cache_dir)
+    if os.path.exists(target):
+        return target, False
+
+    # Pillow is imported on first use so that starting the app does not pay for it
+    from PIL import Image
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with Image.open(source) as img:
+        thumbnail = img.resize(size)
+    temporary = f"{target}.{os.getpid()}.tmp"
+    thumbnail.save(temporary, format="PNG")
+    os.replace(temporary, target)
+    return target, True
+
+
+def get_thumbnail(source, size, cache_dir=THUMBNAIL_DIR) -> str:
+    # Path of the pre-sized image, generating it on first use. Falls back to the source
+    # image if the cache cannot be written, so callers still resize it themselves.
+    try:
+        return make_thumbnail(source, size, cache_dir)[0]
+    except OSError:
+        return source
+
+
+def remove_thumbnails(source, mtime, cache_dir=THUMBNAIL_DIR) -> int:
+    # Deletes the thumbnail made from the version of source last modified at mtime (ns)
+    try:
+        os.remove(thumbnail_path(source, ANIMAL_IMAGE_SIZE, cache_dir, mtime))
+    except FileNotFoundError:
+        return 0
+    return 1
+
+
+def media_sources(animal_media) -> list:
+    sources = []
+    for group in animal_media:
+        for media in group.values():
+            for animal in media["Images"]:
+                sources.append(animal["File"])
+    return sources
+
+
+def required_thumbnails(animal_media) -> list:
+    # Every (source, size) pair the app displays; the tree is shown from a tile pyramid instead
+    return [(source, ANIMAL_IMAGE_SIZE) for source in dict.fromkeys(media_sources(animal_media))]
+
+
+def _make_thumbnail_job(job) -> tuple:
+    source, size, cache_dir = job
+    return make_thumbnail(source, size, cache_dir)
+
+
+def pregenerate_thumbnails(animal_media, cache_dir=THUMBNAIL_DIR, workers=None) -> tuple:
+    # Generates missing thumbnails and the tree's tile pyramid in parallel and removes the ones
+    # no longer referenced. Returns (generated, up to date, removed) counts.
+    from tree_viewer import build_pyramid, remove_stale_pyramids
+
+    start_time = time.perf_counter()
+    jobs = [(source, size, cache_dir) for source, size in required_thumbnails(animal_media)
+            if os.path.exists(source)]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pyramid = executor.submit(build_pyramid, TREE_IMAGE_PATH) if os.path.exists(TREE_IMAGE_PATH) else None
+        results = list(executor.map(_make_thumbnail_job, jobs, chunksize=4))
+        pyramid_built = pyramid is not None and pyramid.result()[1]
+    pyramids_removed = remove_stale_pyramids([TREE_IMAGE_PATH])
+
+    generated = sum(1 for _, created in results if created)
+    wanted = {os.path.basename(path) for path, _ in results}
+    removed = 0
+    for name in os.listdir(cache_dir) if os.path.isdir(cache_dir) else ():
+        if name not in wanted:
+            os.remove(os.path.join(cache_dir, name))
+            removed += 1
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Thumbnails: {generated} generated, {len(results) - generated} up to date, "
+          f"{removed} stale removed; tree tile pyramid {'built' if pyramid_built else 'up to date'}, "
+          f"{pyramids_removed} stale removed in {elapsed:.2f} s", file=sys.stderr)
+    return generated, len(results) - generated, removed
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+import tkinter as tk
+from collections import OrderedDict
+
+
+TILE_DIR = ".tiles"
+TILE_SIZE = 256
+MANIFEST = "pyramid.json"
+
+
+def pyramid_dir(source, tile_dir=TILE_DIR, mtime=None) -> str:
+    # Same cache key as the thumbnails: absolute source path and its mtime
+    mtime = os.stat(source).st_mtime_ns if mtime is None else mtime
+    key = f"{os.path.abspath(source)}|{mtime}|{TILE_SIZE}"
+    return os.path.join(tile_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+def build_pyramid(source, tile_dir=TILE_DIR) -> tuple:
+    # Cuts source into TILE_SIZE tiles at full resolution and at every halving down to a single
+    # tile. Level 0 is the smallest. Returns (pyramid directory, whether it had to be built).
+    target = pyramid_dir(source, tile_dir)
+    if os.path.exists(os.path.join(target, MANIFEST)):
+        return target, False
+
+    from PIL import Image
+
+    # Unique per thread too: the app rebuilds on a loader worker and may start a second build
+    temporary = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    with Image.open(source) as img:
+        level_image = img.convert("RGBA")
+    width, height = level_image.size
+    level_count = max(0, math.ceil(math.log2(max(width, height) / TILE_SIZE))) + 1
+
+    for level in reversed(range(level_count)):
+        level_width, level_height = level_image.size
+        os.makedirs(os.path.join(temporary, str(level)))
+        for row in range(math.ceil(level_height / TILE_SIZE)):
+            for column in range(math.ceil(level_width / TILE_SIZE)):
+                box = (column * TILE_SIZE, row * TILE_SIZE,
+                       min(level_width, (column + 1) * TILE_SIZE), min(level_height, (row + 1) * TILE_SIZE))
+                level_image.crop(box).save(os.path.join(temporary, str(level), f"{column}_{row}.png"),
+                                           format="PNG", compress_level=1)
+        if level:
+            level_image = level_image.resize((max(1, math.ceil(level_width / 2)), max(1, math.ceil(level_height / 2))),
+                                             Image.LANCZOS)
+
+    with open(os.path.join(temporary, MANIFEST), "w") as file:
+        json.dump({"width": width, "height": height, "levels": level_count, "tile_size": TILE_SIZE}, file)
+    try:
+        os.replace(temporary, target)
+    except OSError:
+        # Another process finished the same pyramid first
+        shutil.rmtree(temporary, ignore_errors=True)
+    return target, True
+
+
+def remove_pyramid(source, mtime, tile_dir=TILE_DIR) -> None:
+    shutil.rmtree(pyramid_dir(source, tile_dir, mtime), ignore_errors=True)
+
+
+def remove_stale_pyramids(sources, tile_dir=TILE_DIR) -> int:
+    wanted = {os.path.basename(pyramid_dir(source, tile_dir)) for source in sources if os.path.exists(source)}
+    removed = 0
+    for name in os.listdir(tile_dir) if os.path.isdir(tile_dir) else ():
+        if name not in wanted:
+            shutil.rmtree(os.path.join(tile_dir, name), ignore_errors=True)
+            removed += 1
+    return removed
+
+
+class TilePyramid:
+    # Read side of a pyramid built by build_pyramid, with an LRU of decoded tiles
+    def __init__(self, directory, max_tiles=64) -> None:
+        self.directory = directory
+        self.max_tiles = max_tiles
+        with open(os.path.join(directory, MANIFEST), "r") as file:
+            manifest = json.load(file)
+        self.width = manifest["width"]
+        self.height = manifest["height"]
+        self.levels = manifest["levels"]
+        self.tile_size = manifest["tile_size"]
+        self._tiles = OrderedDict()
+
+    @classmethod
+    def for_image(cls, source, tile_dir=TILE_DIR, max_tiles=64):
+        return cls(build_pyramid(source, tile_dir)[0], max_tiles)
+
+    def level_size(self, level) -> tuple:
+        scale = 2 ** (self.levels - 1 - level)
+        return math.ceil(self.width / scale), math.ceil(self.height / scale)
+
+    def tile_grid(self, level) -> tuple:
+        width, height = self.level_size(level)
+        return math.ceil(width / self.tile_size), math.ceil(height / self.tile_size)
+
+    def fit_level(self, width, height) -> int:
+        # Largest level that fits in width x height
+        for level in reversed(range(self.levels)):
+            level_width, level_height = self.level_size(level)
+            if level_width <= width and level_height <= height:
+                return level
+        return 0
+
+    def tile(self, level, column, row, master=None):
+        key = (level, column, row)
+        photo = self._tiles.get(key)
+        if photo is not None:
+            self._tiles.move_to_end(key)
+            return photo
+
+        from PIL import Image, ImageTk
+
+        with Image.open(os.path.join(self.directory, str(level), f"{column}_{row}.png")) as img:
+            photo = ImageTk.PhotoImage(img, master=master)
+        self._tiles[key] = photo
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        return photo
+
+    def __len__(self) -> int:
+        return len(self._tiles)
+
+
+class TreeViewer:
+    # Pan (drag) and zoom (mouse wheel or +/-) over a tile pyramid. Only the tiles inside the
+    # viewport are decoded and drawn. The window is hidden instead of destroyed when closed.
+    def __init__(self, root, pyramid, width=600, height=600) -> None:
+        self.root = root
+        self.pyramid = pyramid
+        self.level = pyramid.fit_level(width, height)
+        self.view_x = 0
+        self.view_y = 0
+        self._drag_start = None
+        # The PhotoImages on the canvas, kept alive even if the LRU evicts them
+        self._drawn = []
+
+        self.window = tk.Toplevel(root)
+        self.window.title("Classification Tree")
+        self.window.protocol("WM_DELETE_WINDOW", self.window.withdraw)
+        self.canvas = tk.Canvas(self.window, width=width, height=height, bg="white", highlightthickness=0)
+        self.canvas.pack(fill="both", expand=True)
+
+        self.canvas.bind("<Configure>", lambda event: self.render())
+        self.canvas.bind("<ButtonPress-1>", self.on_press)
+        self.canvas.bind("<B1-Motion>", self.on_drag)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.canvas.bind(sequence, self.on_mousewheel)
+        self.window.bind("<plus>", lambda event: self.zoom(1))
+        self.window.bind("<equal>", lambda event: self.zoom(1))
+        self.window.bind("<minus>", lambda event: self.zoom(-1))
+        self.center()
+
+    def show(self, geometry) -> None:
+        self.window.geometry(geometry)
+        self.window.deiconify()
+        self.window.lift()
+        self.render()
+
+    def viewport(self) -> tuple:
+        return max(1, self.canvas.winfo_width()), max(1, self.canvas.winfo_height())
+
+    def center(self) -> None:
+        width, height = self.viewport()
+        level_width, level_height = self.pyramid.level_size(self.level)
+        self.view_x = (level_width - width) // 2
+        self.view_y = (level_height - height) // 2
+
+    def clamp(self) -> None:
+        # Keeps the image on screen; an image smaller than the viewport stays centred
+        width, height = self.viewport()
+        level_width, level_height = self.pyramid.level_size(self.level)
+        self.view_x = (level_width - width) // 2 if level_width <= width else min(max(0, self.view_x), level_width - width)
+        self.view_y = (level_height - height) // 2 if level_height <= height else min(max(0, self.view_y), level_height - height)
+
+    def zoom(self, steps, x=None, y=None) -> None:
+        # One step doubles or halves the scale, keeping the point under (x, y) in place
+        level = min(max(0, self.level + steps), self.pyramid.levels - 1)
+        if level == self.level:
+            return
+        width, height = self.viewport()
+        x = width / 2 if x is None else x
+        y = height / 2 if y is None else y
+        factor = 2 ** (level - self.level)
+        self.view_x = round((self.view_x + x) * factor - x)
+        self.view_y = round((self.view_y + y) * factor - y)
+        self.level = level
+        self.render()
+
+    def on_press(self, event) -> None:
+        self._drag_start = (event.x, event.y)
+
+    def on_drag(self, event) -> None:
+        if self._drag_start is None:
+            return
+        self.view_x -= event.x - self._drag_start[0]
+        self.view_y -= event.y - self._drag_start[1]
+        self._drag_start = (event.x, event.y)
+        self.render()
+
+    def on_mousewheel(self, event) -> None:
+        if event.num == 4 or event.delta > 0:
+            self.zoom(1, event.x, event.y)
+        elif event.num == 5 or event.delta < 0:
+            self.zoom(-1, event.x, event.y)
+
+    def visible_tiles(self) -> list:
+        width, height = self.viewport()
+        columns, rows = self.pyramid.tile_grid(self.level)
+        size = self.pyramid.tile_size
+        first_column, first_row = max(0, self.view_x // size), max(0, self.view_y // size)
+        last_column = min(columns - 1, (self.view_x + width - 1) // size)
+        last_row = min(rows - 1, (self.view_y + height - 1) // size)
+        return [(column, row) for row in range(first_row, last_row + 1)
+                for column in range(first_column, last_column + 1)]
+
+    def render(self) -> None:
+        self.clamp()
+        self.canvas.delete("tile")
+        size = self.pyramid.tile_size
+        self._drawn = []
+        for column, row in self.visible_tiles():
+            photo = self.pyramid.tile(self.level, column, row, self.root)
+            self._drawn.append(photo)
+            self.canvas.create_image(column * size - self.view_x, row * size - self.view_y,
+                                     image=photo, anchor="nw", tags="tile")
@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class VectorizedRuleGraph:
+    # Array form of a RuleGraph that pushes a whole N x F boolean feature matrix through the
+    # rules level by level. Column j of the matrix answers graph.features[j] unless an explicit
+    # column order is passed to classify().
+    def __init__(self, graph) -> None:
+        self.graph = graph
+        node_count = len(graph.nodes)
+
+        self.terminal = np.zeros(node_count, dtype=bool)
+        self.yes = np.arange(node_count, dtype=np.intp)
+        self.no = np.arange(node_count, dtype=np.intp)
+        self.feature_ids = np.zeros((3, node_count), dtype=np.intp)
+        self.has_feature = np.zeros((3, node_count), dtype=bool)
+
+        for node_index, node in enumerate(graph.nodes):
+            if node.is_terminal:
+                self.terminal[node_index] = True
+                continue
+            self.yes[node_index] = node.yes
+            self.no[node_index] = node.no
+            for position, feature_id in enumerate(node.feature_ids[:3]):
+                self.feature_ids[position, node_index] = feature_id
+                self.has_feature[position, node_index] = True
+
+        self.groups = np.array([node.group for node in graph.nodes], dtype=object)
+
+    def classify(self, matrix, columns=None) -> np.ndarray:
+        # Returns the terminal node id reached by every row of the matrix
+        matrix = np.asarray(matrix, dtype=bool)
+        if matrix.ndim != 2:
+            raise ValueError("Feature matrix must be two-dimensional (rows x features)")
+
+        feature_columns = self._feature_columns(matrix.shape[1], columns)
+        row_count = matrix.shape[0]
+        result = np.full(row_count, self.graph.root, dtype=np.intp)
+        if not self.graph.nodes or row_count == 0:
+            return result
+
+        rows = np.arange(row_count, dtype=np.intp)
+        current = result.copy()
+
+        for _ in range(len(self.graph.nodes)):
+            done = self.terminal[current]
+            if done.any():
+                result[rows[done]] = current[done]
+                rows = rows[~done]
+                current = current[~done]
+            if rows.size == 0:
+                return result
+
+            decision = self._answers(matrix, feature_columns, rows, current, 0)
+            second = self._answers(matrix, feature_columns, rows, current, 1)
+            split = decision != second
+            if split.any():
+                decision[split] = self._answers(matrix, feature_columns, rows[split], current[split], 2)
+
+            current = np.where(decision, self.yes[current], self.no[current])
+
+        raise ValueError("Rule graph has a cycle; some rows never reached a terminal group")
+
+    def classify_groups(self, matrix, columns=None) -> np.ndarray:
+        return self.groups[self.classify(matrix, columns)]
+
+    def _feature_columns(self, column_count, columns) -> np.ndarray:
+        # Maps feature ids to matrix columns; features without a column are answered "No"
+        feature_count = len(self.graph.features)
+        if columns is None:
+            if column_count < feature_count:
+                raise ValueError(f"Feature matrix has {column_count} columns, expected {feature_count}")
+            return np.arange(feature_count, dtype=np.intp)
+
+        feature_columns = np.full(feature_count, -1, dtype=np.intp)
+        for column, name in enumerate(columns):
+            feature_id = self.graph.feature_index.get(name)
+            if feature_id is not None:
+                feature_columns[feature_id] = column
+        return feature_columns
+
+    def _answers(self, matrix, feature_columns, rows, current, position) -> np.ndarray:
+        columns = feature_columns[self.feature_ids[position, current]]
+        present = self.has_feature[position, current] & (columns >= 0)
+        answers = matrix[rows, np.where(present, columns, 0)]
+        return answers & present
+
+
+def feature_matrix(graph, records) -> np.ndarray:
+    # Builds the N x F matrix for graph.features from feature -> bool dicts
+    records = list(records)
+    matrix = np.zeros((len(records), len(graph.features)), dtype=bool)
+    feature_index = graph.feature_index
+    for row, record in enumerate(records):
+        for name, value in record.items():
+            feature_id = feature_index.get(name)
+            if feature_id is not None and value:
+                matrix[row, feature_id] = True
+    return matrix